@@ -0,0 +1,267 @@
+import asyncio
+import io
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import List
+
+from fastapi import FastAPI, File, Form, HTTPException, Request, UploadFile
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import iterate_in_threadpool
+from PIL import UnidentifiedImageError
+
+import metrics
+from preprocessing import ImageTooLarge, preprocess_upload
+from scheduler import BATCH, INTERACTIVE, DeadlineExceeded, QueueFull
+from vqa_service import VQAService
+
+# Threads that block on the shared micro-batcher; concurrent requests from
+# these workers end up in the same model batch
+API_WORKERS = 16
+
+# Requests admitted at once (running + waiting); beyond this we answer 429
+MAX_QUEUE_DEPTH = 64
+
+service = VQAService()
+executor = ThreadPoolExecutor(max_workers=API_WORKERS, thread_name_prefix="vqa-api")
+
+
+# Counts in-flight questions and refuses new ones past the depth limit
+class Admission:
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self, count=1):
+        with self._lock:
+            if self.in_flight + count > self.limit:
+                return False
+            self.in_flight += count
+            return True
+
+    def release(self, count=1):
+        with self._lock:
+            self.in_flight -= count
+
+    # A release() for count slots that only takes effect the first time
+    def releaser(self, count=1):
+        held = [count]
+
+        def release():
+            with self._lock:
+                self.in_flight -= held[0]
+                held[0] = 0
+
+        return release
+
+
+admission = Admission(MAX_QUEUE_DEPTH)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    service.start()
+    yield
+    executor.shutdown(wait=False, cancel_futures=True)
+    # Stops the batcher thread once its queued requests have run (or the
+    # worker processes, releasing their shared memory), off the event loop
+    await asyncio.to_thread(service.close)
+
+
+app = FastAPI(title="Explainable VQA API", lifespan=lifespan)
+
+
+def decode_image(data):
+    try:
+        return preprocess_upload(io.BytesIO(data)).model_image
+    except ImageTooLarge as exc:
+        raise HTTPException(status_code=413, detail=str(exc))
+    except (UnidentifiedImageError, OSError) as exc:
+        raise HTTPException(status_code=400, detail=f"Could not decode image: {exc}")
+
+
+# Client address: each client takes its turn in the model queue
+def _session(request):
+    return request.client.host if request.client else None
+
+
+def _overloaded(detail=f"Too many requests in flight (limit {MAX_QUEUE_DEPTH})"):
+    metrics.inc("vqa_rejected_total")
+    return HTTPException(status_code=429, detail=detail, headers={"Retry-After": "1"})
+
+
+# Maps the scheduler's refusals to HTTP errors
+def _scheduled(fn, *args, **kwargs):
+    try:
+        return fn(*args, **kwargs)
+    except QueueFull as exc:
+        raise _overloaded(str(exc))
+    except DeadlineExceeded as exc:
+        raise HTTPException(status_code=504, detail=str(exc))
+
+
+# Runs on an executor thread: decoding is CPU work and must not block the loop
+def _answer(data, question, include_heatmap, session, priority):
+    result = dict(_scheduled(service.answer_question, decode_image(data), question, session=session, priority=priority))
+    if not include_heatmap:
+        result.pop("heatmap", None)
+    return result
+
+
+async def _run_all(pairs, include_heatmap, session=None, priority=INTERACTIVE):
+    if service.loader.error is not None:
+        raise HTTPException(status_code=503, detail="VQA model failed to load")
+    if not admission.try_acquire(len(pairs)):
+        raise _overloaded()
+
+    loop = asyncio.get_running_loop()
+    try:
+        return await asyncio.gather(*(
+            loop.run_in_executor(executor, _answer, data, question, include_heatmap, session, priority)
+            for data, question in pairs
+        ))
+    finally:
+        admission.release(len(pairs))
+
+
+@app.get("/health")
+async def health():
+    return {
+        "backend": service.backend.name,
+        "state": service.loader.state,
+        "in_flight": admission.in_flight,
+        "max_queue_depth": MAX_QUEUE_DEPTH,
+        "queued": service.scheduler.qsize() if service.scheduler is not None else None,
+        "timings": service.loader.timings(),
+        "memory_mb": service.loader.memory(),
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/vqa")
+async def vqa(
+    request: Request,
+    image: UploadFile = File(...),
+    question: str = Form(...),
+    include_heatmap: bool = Form(False),
+):
+    results = await _run_all([(await image.read(), question)], include_heatmap, _session(request))
+    return results[0]
+
+
+def _start_stream(data, question, session):
+    return _scheduled(service.stream_question, decode_image(data), question, session=session)
+
+
+# Newline-delimited JSON: {"token": ...} lines as the answer is generated,
+# then one {"result": ...} line with confidence and timing. Decoding and
+# queueing happen before the response starts, so their errors get the same
+# status codes as /vqa; only a failure mid-answer becomes an {"error": ...}
+# line.
+@app.post("/vqa/stream")
+async def vqa_stream(
+    request: Request,
+    image: UploadFile = File(...),
+    question: str = Form(...),
+    include_heatmap: bool = Form(False),
+):
+    if service.loader.error is not None:
+        raise HTTPException(status_code=503, detail="VQA model failed to load")
+    data = await image.read()
+    session = _session(request)
+    if not admission.try_acquire():
+        raise _overloaded()
+    # Released when the body ends, or after the response when the client
+    # disconnected before the body was read
+    release = admission.releaser()
+    try:
+        stream = await asyncio.get_running_loop().run_in_executor(executor, _start_stream, data, question, session)
+    except BaseException:
+        release()
+        raise
+
+    def lines():
+        try:
+            for token in stream:
+                yield json.dumps({"token": token}) + "\n"
+            result = dict(stream.result)
+            if not include_heatmap:
+                result.pop("heatmap", None)
+            if stream.first_token_seconds is not None:
+                result["first_token_ms"] = stream.first_token_seconds * 1000
+            yield json.dumps({"result": result}) + "\n"
+        except Exception as exc:
+            yield json.dumps({"error": str(exc)}) + "\n"
+        finally:
+            release()
+
+    return StreamingResponse(
+        iterate_in_threadpool(lines()), media_type="application/x-ndjson", background=BackgroundTask(release)
+    )
+
+
+# Either one question per image, or a single question asked of every image
+@app.post("/vqa/batch")
+async def vqa_batch(
+    request: Request,
+    images: List[UploadFile] = File(...),
+    questions: List[str] = Form(...),
+    include_heatmap: bool = Form(False),
+):
+    if len(questions) == 1:
+        questions = questions * len(images)
+    if len(questions) != len(images):
+        raise HTTPException(status_code=422, detail="Send one question, or one question per image")
+    if len(images) > MAX_QUEUE_DEPTH:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_QUEUE_DEPTH} images per batch")
+
+    data = [await upload.read() for upload in images]
+    results = await _run_all(list(zip(data, questions)), include_heatmap, _session(request), BATCH)
+    return {"results": results}
+
+
+def _answer_all(data, questions, include_heatmap, session):
+    answers = _scheduled(service.answer_questions, decode_image(data), questions, session=session)
+    results = [dict(result) for result in answers]
+    if not include_heatmap:
+        for result in results:
+            result.pop("heatmap", None)
+    return results
+
+
+# Several questions about one image, sharing a single vision encoder pass
+@app.post("/vqa/questions")
+async def vqa_questions(
+    request: Request,
+    image: UploadFile = File(...),
+    questions: List[str] = Form(...),
+    include_heatmap: bool = Form(False),
+):
+    if len(questions) > MAX_QUEUE_DEPTH:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_QUEUE_DEPTH} questions per image")
+    if service.loader.error is not None:
+        raise HTTPException(status_code=503, detail="VQA model failed to load")
+    data = await image.read()
+    if not admission.try_acquire(len(questions)):
+        raise _overloaded()
+
+    try:
+        results = await asyncio.get_running_loop().run_in_executor(
+            executor, _answer_all, data, questions, include_heatmap, _session(request)
+        )
+    finally:
+        admission.release(len(questions))
+    return {"results": [{"question": question, **result} for question, result in zip(questions, results)]}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=8000)
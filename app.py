@@ -1,9 +1,18 @@
 import streamlit as st
-import torch
-from transformers import BlipProcessor, BlipForQuestionAnswering
-from PIL import Image
 import requests
-import numpy as np
+
+import metrics
+from bulk import LOW_CONFIDENCE, show_checklist, show_export_buttons, show_upload_grid
+from model_loader import FAILED
+from preprocessing import ImageTooLarge
+from question_router import SAMPLE_QUESTIONS
+from scheduler import DeadlineExceeded, QueueFull, queue_indicator
+from session_store import create_store, current_session_id, session_upload
+from static_assets import inject_css
+from vqa_service import VQAService
+
+# Stream answer tokens as they are generated (no alternative answers)
+STREAM_ANSWERS = True
 
 # Page configuration with custom styling
 st.set_page_config(
@@ -14,116 +23,51 @@ st.set_page_config(
 )
 
 
-# Custom CSS for poppy abstract background and punchy colors
-def load_custom_css():
-    st.markdown("""
-    <style>
-    .stApp {
-        background: linear-gradient(45deg, #FF6B6B, #4ECDC4, #45B7D1, #96CEB4, #FECA57, #FF9FF3, #54A0FF);
-        background-size: 300% 300%;
-        animation: gradientShift 8s ease infinite;
-    }
-
-    @keyframes gradientShift {
-        0% { background-position: 0% 50%; }
-        50% { background-position: 100% 50%; }
-        100% { background-position: 0% 50%; }
-    }
-
-    .main-header {
-        background: rgba(255, 255, 255, 0.95);
-        padding: 2rem;
-        border-radius: 20px;
-        margin-bottom: 2rem;
-        box-shadow: 0 8px 32px rgba(0, 0, 0, 0.1);
-        backdrop-filter: blur(10px);
-        border: 1px solid rgba(255, 255, 255, 0.2);
-    }
-
-    .upload-section {
-        background: rgba(255, 255, 255, 0.9);
-        padding: 1.5rem;
-        border-radius: 15px;
-        margin-bottom: 1rem;
-        box-shadow: 0 4px 20px rgba(0, 0, 0, 0.1);
-    }
-
-    .question-section {
-        background: rgba(255, 255, 255, 0.9);
-        padding: 1.5rem;
-        border-radius: 15px;
-        margin-bottom: 1rem;
-        box-shadow: 0 4px 20px rgba(0, 0, 0, 0.1);
-    }
-
-    .result-section {
-        background: rgba(255, 255, 255, 0.95);
-        padding: 2rem;
-        border-radius: 15px;
-        margin-top: 1rem;
-        box-shadow: 0 6px 25px rgba(0, 0, 0, 0.15);
-    }
-
-    .stButton > button {
-        background: linear-gradient(45deg, #FF6B6B, #4ECDC4);
-        color: white;
-        border: none;
-        border-radius: 25px;
-        padding: 0.5rem 2rem;
-        font-weight: bold;
-        transition: all 0.3s ease;
-    }
-
-    .stButton > button:hover {
-        transform: translateY(-2px);
-        box-shadow: 0 5px 15px rgba(0, 0, 0, 0.2);
-    }
-
-    .answer-box {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        color: white;
-        padding: 1.5rem;
-        border-radius: 15px;
-        margin: 1rem 0;
-        font-size: 1.1rem;
-        font-weight: 500;
-    }
-
-    .confidence-bar {
-        background: linear-gradient(90deg, #FF6B6B, #4ECDC4, #45B7D1);
-        height: 10px;
-        border-radius: 5px;
-        margin: 0.5rem 0;
-    }
-    </style>
-    """, unsafe_allow_html=True)
+# One VQA service per process, shared by every session. The model loads on a
+# background thread so the page renders immediately.
+@st.cache_resource
+def load_service():
+    return VQAService().start()
 
 
-# Load model with caching
+# Decoded uploads shared by all sessions; each session keeps only a key
 @st.cache_resource
+def load_image_store():
+    return create_store()
+
+
+def load_model_loader():
+    return load_service().loader
+
+
 def load_vqa_model():
-    processor = BlipProcessor.from_pretrained("Salesforce/blip-vqa-base")
-    model = BlipForQuestionAnswering.from_pretrained("Salesforce/blip-vqa-base")
-    return processor, model
+    return load_service().load_vqa_model()
 
 
-# VQA function
-def answer_question(image, question, processor, model):
-    inputs = processor(image, question, return_tensors="pt")
+# VQA function: returns a dict with answer, confidence and alternatives.
+# Requests queue per session; on_wait shows the queue position while waiting.
+def answer_question(image, question, image_hash=None, on_wait=None):
+    return load_service().answer_question(
+        image, question, image_hash=image_hash, session=current_session_id(), on_wait=on_wait
+    )
 
-    with torch.no_grad():
-        outputs = model.generate(**inputs, max_length=50)
-        answer = processor.decode(outputs[0], skip_special_tokens=True)
 
-    # Mock confidence score for demo
-    confidence = np.random.uniform(0.75, 0.95)
+def stream_question(image, question, image_hash=None, on_wait=None):
+    return load_service().stream_question(
+        image, question, image_hash=image_hash, session=current_session_id(), on_wait=on_wait
+    )
 
-    return answer, confidence
+
+# Many questions about one image; the image is encoded once for all of them
+def answer_questions(image, questions, image_hash=None, on_wait=None):
+    return load_service().answer_questions(
+        image, questions, image_hash=image_hash, session=current_session_id(), on_wait=on_wait
+    )
 
 
 # Main application
 def main():
-    load_custom_css()
+    inject_css("app.css", reduced_motion=st.session_state.get("reduced_motion", False))
 
     # Header
     st.markdown("""
@@ -137,9 +81,12 @@ def main():
     </div>
     """, unsafe_allow_html=True)
 
-    # Load model
-    with st.spinner("🔄 Loading VQA Model..."):
-        processor, model = load_vqa_model()
+    # Model status (loading continues in the background)
+    loader = load_model_loader()
+    if loader.state == FAILED:
+        st.error(f"❌ The VQA model failed to load: {loader.error}")
+    elif not loader.ready:
+        st.info("🔄 Loading VQA model in the background - you can upload an image meanwhile.")
 
     # Layout
     col1, col2 = st.columns([1, 1])
@@ -147,82 +94,208 @@ def main():
     with col1:
         st.markdown('<div class="upload-section">', unsafe_allow_html=True)
         st.markdown("### 📸 Upload Your Image")
-        uploaded_file = st.file_uploader(
-            "Choose an image...",
-            type=['jpg', 'jpeg', 'png', 'bmp'],
-            help="Upload an image to ask questions about"
-        )
-
-        if uploaded_file:
-            image = Image.open(uploaded_file)
-            st.image(image, caption="Uploaded Image", use_column_width=True)
+        bulk_mode = st.toggle("📁 Many images (files or .zip)", help="Ask one question of every uploaded image")
+        uploaded_files = []
+        if bulk_mode:
+            uploaded_files = st.file_uploader(
+                "Choose images or zip archives...",
+                type=['jpg', 'jpeg', 'png', 'bmp', 'zip'],
+                accept_multiple_files=True
+            )
+            uploaded_file = None
+        else:
+            uploaded_file = st.file_uploader(
+                "Choose an image...",
+                type=['jpg', 'jpeg', 'png', 'bmp'],
+                help="Upload an image to ask questions about"
+            )
+
+        try:
+            stored = session_upload(load_image_store(), uploaded_file)
+        except ImageTooLarge as exc:
+            st.error(f"❌ {exc}")
+            uploaded_file = None
+        else:
+            if stored is not None:
+                prepared = stored.prepared
+                image = prepared.model_image
+                st.image(prepared.display_image, caption="Uploaded Image", use_column_width=True)
+                width, height = prepared.original_size
+                st.caption(f"🖼️ {width}×{height} · prepared in {prepared.timings['total'] * 1000:.0f} ms")
         st.markdown('</div>', unsafe_allow_html=True)
 
     with col2:
         st.markdown('<div class="question-section">', unsafe_allow_html=True)
         st.markdown("### ❓ Ask Your Question")
-        question = st.text_area(
-            "What would you like to know about this image?",
-            placeholder="e.g., What color is the car? How many people are in the image?",
-            height=100
-        )
+        checklist_mode = st.toggle("📋 Ask a checklist of questions", help="One question per line, answered together")
+        if checklist_mode:
+            checklist = st.text_area(
+                "Questions (one per line)",
+                value="\n".join(SAMPLE_QUESTIONS),
+                height=180
+            )
+            questions = [line.strip() for line in checklist.splitlines() if line.strip()]
+            question = questions[0] if questions else ""
+        else:
+            question = st.text_area(
+                "What would you like to know about this image?",
+                placeholder="e.g., What color is the car? How many people are in the image?",
+                height=100
+            )
 
         analyze_button = st.button("🔍 Analyze Image", type="primary")
         st.markdown('</div>', unsafe_allow_html=True)
 
+    # Batch results: one question across every uploaded image
+    if bulk_mode and uploaded_files and question and analyze_button:
+        st.markdown('<div class="result-section">', unsafe_allow_html=True)
+        st.markdown(f"### 🗂️ {question}")
+        with st.spinner("🔄 Waiting for the VQA model to finish loading..."):
+            load_vqa_model()
+        st.session_state.bulk_rows = show_upload_grid(load_service(), uploaded_files, question)
+        st.markdown('</div>', unsafe_allow_html=True)
+    if bulk_mode and st.session_state.get("bulk_rows"):
+        show_export_buttons(st.session_state.bulk_rows)
+
     # Results section
     if uploaded_file and question and analyze_button:
         st.markdown('<div class="result-section">', unsafe_allow_html=True)
 
-        with st.spinner("🤖 Analyzing image and generating answer..."):
-            answer, confidence = answer_question(image, question, processor, model)
+        with st.spinner("🔄 Waiting for the VQA model to finish loading..."):
+            load_vqa_model()
+
+        image_hash = stored.image_hash
 
         # Display results
         st.markdown("### 🎯 Analysis Results")
 
-        # Answer with styling
-        st.markdown(f"""
-        <div class="answer-box">
-            <strong>🔮 Answer:</strong> {answer}
-        </div>
-        """, unsafe_allow_html=True)
-
-        # Confidence score
-        st.markdown(f"**🎯 Confidence Score:** {confidence:.2%}")
-        st.markdown(f'<div class="confidence-bar" style="width: {confidence * 100}%;"></div>',
-                    unsafe_allow_html=True)
-
-        # Mock explanation section
-        with st.expander("🔍 View Explanation (Demo)", expanded=True):
-            st.markdown("""
-            **🧠 How the model analyzed this image:**
-            - **Visual Features Detected:** Objects, colors, spatial relationships
-            - **Question Processing:** Natural language understanding of your query  
-            - **Answer Generation:** Combining visual and textual reasoning
-            - **Attention Areas:** The model focused on relevant image regions
-
-            *Note: This is a demo version. Full explainability features would include 
-            attention heatmaps and detailed reasoning chains.*
-            """)
+        # Shows this session's place in the shared model queue while it waits
+        queue_slot = st.empty()
+        on_wait = queue_indicator(queue_slot)
+        busy = "⏳ The model is busy with other users right now - please try again in a moment."
+
+        if checklist_mode:
+            results = None
+            try:
+                with st.spinner(f"🤖 Answering {len(questions)} questions..."):
+                    results = answer_questions(image, questions, image_hash=image_hash, on_wait=on_wait)
+            except (QueueFull, DeadlineExceeded):
+                st.warning(busy)
+            queue_slot.empty()
+            if results is not None:
+                show_checklist(questions, results)
+        else:
+            # The answer streams into this slot, then the styled box replaces it once
+            answer_slot = st.empty()
+            result = None
+            try:
+                if STREAM_ANSWERS:
+                    stream = stream_question(image, question, image_hash=image_hash, on_wait=on_wait)
+                    queue_slot.empty()
+                    answer_slot.write_stream(stream)
+                    result = stream.result
+                    if stream.first_token_seconds is not None:
+                        st.caption(f"⚡ First token after {stream.first_token_seconds * 1000:.0f} ms")
+                else:
+                    with st.spinner("🤖 Analyzing image and generating answer..."):
+                        result = answer_question(image, question, image_hash=image_hash, on_wait=on_wait)
+            except (QueueFull, DeadlineExceeded):
+                st.warning(busy)
+            queue_slot.empty()
+
+            if result is not None:
+                answer, confidence = result["answer"], result["confidence"]
+
+                # Answer with styling
+                answer_slot.markdown(f"""
+                <div class="answer-box">
+                    <strong>🔮 Answer:</strong> {answer}
+                </div>
+                """, unsafe_allow_html=True)
+
+                # Confidence score
+                st.markdown(f"**🎯 Confidence Score:** {confidence:.2%}")
+                st.markdown(f'<div class="confidence-bar" style="width: {confidence * 100}%;"></div>',
+                            unsafe_allow_html=True)
+
+                if confidence < LOW_CONFIDENCE:
+                    st.warning("⚠️ The model is unsure about this answer - consider rephrasing the question.")
+
+                if result["alternatives"]:
+                    alternatives = ", ".join(
+                        f"{alt['answer']} ({alt['confidence']:.0%})" for alt in result["alternatives"]
+                    )
+                    st.markdown(f"**🔀 Other candidates:** {alternatives}")
+
+                # Explanation section
+                with st.expander("🔍 View Explanation", expanded=True):
+                    st.markdown("""
+                    **🧠 How the model analyzed this image:**
+                    - **Visual Features Detected:** Objects, colors, spatial relationships
+                    - **Question Processing:** Natural language understanding of your query  
+                    - **Answer Generation:** Combining visual and textual reasoning
+                    - **Attention Areas:** The model focused on relevant image regions
+                    """)
+
+                    overlay = load_service().heatmap_overlay(
+                        prepared.display_image, question, result, image_hash=image_hash
+                    )
+                    if overlay is not None:
+                        st.image(overlay, caption="🔥 Question-to-image attention (rollout)", use_column_width=True)
 
         st.markdown('</div>', unsafe_allow_html=True)
 
     # Sidebar with sample questions
     with st.sidebar:
+        st.toggle("🪫 Reduced motion", key="reduced_motion", help="Turn off background and button animations")
+
         st.markdown("### 💡 Sample Questions")
-        sample_questions = [
-            "What is the main object in this image?",
-            "What color is the dominant object?",
-            "How many people are visible?",
-            "What is the setting or location?",
-            "What activity is taking place?",
-            "What time of day does this appear to be?"
-        ]
-
-        for q in sample_questions:
+        for q in SAMPLE_QUESTIONS:
             if st.button(q, key=f"sample_{q}"):
                 st.rerun()
 
+        cache_stats = load_service().embedding_cache.stats()
+        st.caption(
+            f"🧠 Image cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+            f"({cache_stats['entries']} images)"
+        )
+        answer_stats = load_service().answer_cache.stats()
+        st.caption(f"💾 Answer cache: {answer_stats['hits']} hits / {answer_stats['misses']} misses")
+        if load_service().near_duplicates is not None:
+            duplicate_stats = load_service().near_duplicates.stats()
+            st.caption(
+                f"🪞 Near-duplicate images: {duplicate_stats['matches']} matched / {duplicate_stats['entries']} seen"
+            )
+        store_stats = load_image_store().stats()
+        session_stats = load_image_store().session_stats(current_session_id())
+        st.caption(
+            f"🗃️ Images: {session_stats['bytes'] / 2**20:.1f} MB this session · "
+            f"{store_stats['bytes'] / 2**20:.0f}/{store_stats['max_bytes'] / 2**20:.0f} MB "
+            f"across {store_stats['sessions']} sessions"
+        )
+
+        loader.mark_first_paint()
+        timings = loader.timings()
+        st.caption(
+            f"⏱️ First paint {timings['first_paint']:.2f}s · model {loader.state}"
+            + (f" after {timings['ready']:.1f}s" if "ready" in timings else "")
+        )
+        memory = loader.memory()
+        if "rss_mb" in memory:
+            st.caption(
+                f"🧠 Model loaded in {timings['load']:.1f}s · RSS {memory['rss_mb']:.0f} MB"
+                + (f" ({memory['rss_file_mb']:.0f} MB shared file pages)" if "rss_file_mb" in memory else "")
+            )
+
+        with st.expander("🛠️ Debug metrics"):
+            rows = metrics.REGISTRY.snapshot()
+            if not metrics.REGISTRY.enabled:
+                st.caption("Metrics are disabled (VQA_METRICS=0).")
+            elif rows:
+                st.dataframe(rows, hide_index=True)
+            else:
+                st.caption("No requests yet.")
+
         st.markdown("---")
         st.markdown("### ℹ️ About This Demo")
         st.markdown("""
@@ -240,4 +313,5 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    with metrics.timer("vqa_stage_seconds", stage="render"):
+        main()
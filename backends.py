@@ -0,0 +1,276 @@
+import hashlib
+import importlib
+import os
+import random
+import re
+import time
+
+import numpy as np
+
+from generation import GENERATION_MODE, GenerationPolicy
+from question_router import CATEGORIES, classify_many
+
+# Temperature T in BLIP's confidence = exp(mean token log-prob / T). The
+# default 1.0 is uncalibrated; evaluate.py fits T on a labelled manifest.
+CONFIDENCE_TEMPERATURE = float(os.environ.get("VQA_CONFIDENCE_TEMPERATURE", "1.0"))
+
+
+# A stream that is already complete (cached answers, non-streaming backends).
+# Nothing was generated live, so there is no first-token time to report.
+class CompletedStream:
+    first_token_seconds = None
+
+    def __init__(self, result):
+        self.result = result
+
+    def __iter__(self):
+        yield self.result["answer"]
+
+    def wait(self):
+        pass
+
+
+# Interface every model backend implements. Results are dicts with "answer",
+# "confidence", "alternatives", when explaining a patch-grid "heatmap", and
+# "downgraded": True when load cut decoding short (see generation.py).
+# import_modules/load/warmup are called once, in that order, by ModelLoader.
+class VQABackend:
+    name = "base"
+    # False for backends that can answer without an uploaded image
+    needs_image = True
+    # Temperature the confidences were scaled with (see CONFIDENCE_TEMPERATURE)
+    temperature = 1.0
+
+    def import_modules(self):
+        pass
+
+    def load(self):
+        pass
+
+    def warmup(self):
+        pass
+
+    # fn() returns how many requests are queued for this backend; backends
+    # that adapt to load (see generation.py) use it
+    def set_queue_depth(self, fn):
+        pass
+
+    # Settings that change what answer_batch returns for the same input;
+    # cached answers are keyed on them (see caching.config_fingerprint)
+    def cache_config(self):
+        return {"backend": self.name}
+
+    def answer_batch(self, images, questions, image_hashes=None):
+        raise NotImplementedError
+
+    def answer(self, image, question, image_hash=None):
+        return self.answer_batch([image], [question], [image_hash] if image_hash else None)[0]
+
+    def explain(self, image, question, result):
+        return result.get("heatmap")
+
+    def stream(self, image, question, image_hash=None, on_complete=None):
+        result = self.answer(image, question, image_hash)
+        if on_complete is not None:
+            on_complete(result)
+        return CompletedStream(result)
+
+
+# Salesforce BLIP through vqa_pipeline; precision is fp32, int8 or onnx.
+# Decoding settings come from a GenerationPolicy (generation_mode fast or
+# quality), chosen per batch.
+class BlipBackend(VQABackend):
+    name = "blip"
+
+    def __init__(
+        self,
+        precision="fp32",
+        top_k=0,
+        explain=False,
+        embedding_cache=None,
+        generation_mode=GENERATION_MODE,
+        temperature=CONFIDENCE_TEMPERATURE,
+    ):
+        self.precision = precision
+        self.temperature = temperature
+        self.top_k = top_k
+        self.explain_enabled = explain
+        self.embedding_cache = embedding_cache
+        self.policy = GenerationPolicy(generation_mode, top_k=top_k)
+        self.pipeline = None
+        self.processor = None
+        self.model = None
+
+    # torch/transformers are only imported here, never at module import
+    def import_modules(self):
+        self.pipeline = importlib.import_module("vqa_pipeline")
+
+    def load(self):
+        if self.pipeline is None:
+            self.import_modules()
+        self.processor, self.model = self.pipeline.load_vqa_model(backend=self.precision)
+
+    def warmup(self):
+        self.pipeline.warmup(self.processor, self.model)
+
+    def set_queue_depth(self, fn):
+        self.policy.queue_depth = fn
+
+    def cache_config(self):
+        return {
+            "backend": self.name,
+            "precision": self.precision,
+            "generation_mode": self.policy.mode,
+            "top_k": self.top_k,
+            "explain": self.explain_enabled,
+            "temperature": self.temperature,
+        }
+
+    def answer_batch(self, images, questions, image_hashes=None):
+        started = time.perf_counter()
+        results = self.pipeline.answer_batch(
+            images,
+            questions,
+            self.processor,
+            self.model,
+            embedding_cache=self.embedding_cache,
+            image_hashes=image_hashes,
+            temperature=self.temperature,
+            explain=self.explain_enabled,
+            generation=self.policy.settings(questions),
+        )
+        self.policy.record(time.perf_counter() - started, len(questions))
+        return results
+
+    # Streams tokens as generate() produces them (always greedy, so no
+    # alternatives)
+    def stream(self, image, question, image_hash=None, on_complete=None):
+        return self.pipeline.AnswerStream(
+            image,
+            question,
+            self.processor,
+            self.model,
+            embedding_cache=self.embedding_cache,
+            image_hash=image_hash,
+            temperature=self.temperature,
+            explain=self.explain_enabled,
+            on_complete=on_complete,
+            generation=self.policy.settings([question], streaming=True),
+        )
+
+
+# Canned answers per question category
+MOCK_RESPONSES = {
+    "color": [
+        "The dominant color in this image is blue.",
+        "I can see red and white colors prominently.",
+        "The main colors are green and brown.",
+        "There are multiple colors including yellow, orange, and purple."
+    ],
+    "people": [
+        "I can see 2 people in this image.",
+        "There are 3 people visible in the scene.",
+        "I detect 1 person in the image.",
+        "There appear to be 4 people in this photo."
+    ],
+    "object": [
+        "The main object in this image is a car.",
+        "I can see a large building as the primary subject.",
+        "The central object appears to be a bicycle.",
+        "The main focus is on a beautiful tree."
+    ],
+    "location": [
+        "This appears to be taken in a park or outdoor setting.",
+        "The location looks like an indoor office or workspace.",
+        "This seems to be a residential area with houses.",
+        "The setting appears to be a busy city street."
+    ],
+    "activity": [
+        "The people in the image appear to be walking.",
+        "I can see someone riding a bicycle.",
+        "The activity shown is people having a conversation.",
+        "The scene shows people working at computers."
+    ]
+}
+
+
+# Keyword-routed canned answers with no model behind them. Fast enough to
+# load-test the serving path; seed it (or set VQA_MOCK_SEED) for repeatable runs.
+class MockBackend(VQABackend):
+    name = "mock"
+    needs_image = False
+
+    def __init__(self, seed=None, explain=False, **options):
+        self.rng = random.Random(seed if seed is not None else os.environ.get("VQA_MOCK_SEED"))
+        self.explain_enabled = explain
+
+    def seed(self, seed):
+        self.rng.seed(seed)
+
+    def cache_config(self):
+        return {"backend": self.name, "explain": self.explain_enabled}
+
+    def answer_batch(self, images, questions, image_hashes=None):
+        results = []
+        for question, category in zip(questions, classify_many(questions)):
+            # A keyword match is a real signal, a random fallback category is a guess
+            matched = category is not None
+            if not matched:
+                category = self.rng.choice(CATEGORIES)
+            result = {
+                "answer": self.rng.choice(MOCK_RESPONSES[category]),
+                "confidence": 0.9 if matched else 0.55,
+                "alternatives": [],
+            }
+            if self.explain_enabled:
+                result["heatmap"] = mock_heatmap(question)
+            results.append(result)
+        return results
+
+    def stream(self, image, question, image_hash=None, on_complete=None):
+        result = self.answer(image, question, image_hash)
+        if on_complete is not None:
+            on_complete(result)
+        return MockStream(result)
+
+
+# Streams a mock answer word by word
+class MockStream(CompletedStream):
+    def __iter__(self):
+        for match in re.finditer(r"\S+\s*", self.result["answer"]):
+            yield match.group(0)
+
+
+# A smooth blob whose position depends only on the question, on BLIP's 24x24 grid
+def mock_heatmap(question, side=24):
+    digest = hashlib.blake2b(question.encode(), digest_size=2).digest()
+    center_y, center_x = digest[0] % side, digest[1] % side
+    ys, xs = np.mgrid[0:side, 0:side]
+    grid = np.exp(-((ys - center_y) ** 2 + (xs - center_x) ** 2) / (2 * (side / 6) ** 2))
+    return np.round(grid, 3).tolist()
+
+
+_REGISTRY = {
+    "blip": lambda **options: BlipBackend("fp32", **options),
+    "blip-int8": lambda **options: BlipBackend("int8", **options),
+    "blip-onnx": lambda **options: BlipBackend("onnx", **options),
+    "mock": MockBackend,
+}
+
+# Older VQA_BACKEND values that named a BLIP precision directly
+_ALIASES = {"fp32": "blip", "int8": "blip-int8", "onnx": "blip-onnx"}
+
+
+def register_backend(name, factory):
+    _REGISTRY[name] = factory
+
+
+def backend_names():
+    return sorted(_REGISTRY)
+
+
+def create_backend(name, **options):
+    name = _ALIASES.get(name, name)
+    if name not in _REGISTRY:
+        raise ValueError(f"Unknown VQA backend {name!r}, expected one of {backend_names()}")
+    return _REGISTRY[name](**options)
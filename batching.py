@@ -0,0 +1,87 @@
+import threading
+import time
+from concurrent.futures import Future
+
+import metrics
+from scheduler import INTERACTIVE, RequestScheduler
+
+
+# Collects concurrent requests into micro-batches and runs them on one worker
+# thread. A batch is flushed when it reaches max_batch_size or when the oldest
+# request has waited max_wait_ms, whichever comes first. Requests wait in a
+# RequestScheduler, which decides whose request goes into the next batch.
+class MicroBatcher:
+    def __init__(self, batch_fn, max_batch_size=8, max_wait_ms=10, scheduler=None):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.batches_run = 0
+        self.requests_run = 0
+        self.scheduler = scheduler or RequestScheduler()
+        self._thread = threading.Thread(target=self._run, name="vqa-batcher", daemon=True)
+        self._thread.start()
+
+    # Raises scheduler.QueueFull when the queue has no room
+    def submit(self, item, session=None, priority=INTERACTIVE, deadline=None):
+        return self.submit_many([item], session, priority, deadline)[0]
+
+    # Requests waiting for a batch
+    def pending(self):
+        return self.scheduler.qsize()
+
+    # Admitted together, so without other sessions waiting the items land in
+    # the same batch
+    def submit_many(self, items, session=None, priority=INTERACTIVE, deadline=None):
+        futures = [Future() for _ in items]
+        self.scheduler.put_many(list(zip(items, futures)), session, priority, deadline)
+        return futures
+
+    # Queued requests are still run before the thread stops
+    def close(self):
+        self.scheduler.close()
+        self._thread.join()
+
+    def _collect(self):
+        first = self.scheduler.get()
+        if first is None:
+            return None
+
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            entry = self.scheduler.get(timeout=remaining)
+            if entry is None:
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+
+            # Drop requests whose caller already cancelled them
+            batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            metrics.observe("vqa_batch_size", len(batch))
+            started = time.perf_counter()
+            try:
+                with metrics.timer("vqa_stage_seconds", stage="batch"):
+                    results = self.batch_fn([item for item, _ in batch])
+            except Exception as exc:
+                metrics.inc("vqa_errors_total", len(batch), stage="batch")
+                for _, future in batch:
+                    future.set_exception(exc)
+                continue
+
+            self.scheduler.record(time.perf_counter() - started, len(batch))
+            self.batches_run += 1
+            self.requests_run += len(batch)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
@@ -0,0 +1,378 @@
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+# Benchmarks start from empty caches: never read answers persisted by the app
+os.environ.pop("VQA_ANSWER_CACHE_PATH", None)
+
+from backends import backend_names
+from evaluate import percentile
+from preprocessing import preprocess_upload
+from question_router import QUICK_QUESTIONS, SAMPLE_QUESTIONS
+from scheduler import BATCH, DeadlineExceeded, QueueFull
+from vqa_service import VQAService
+
+# Upload sizes for the single-request latency scenario (width, height)
+RESOLUTIONS = [(384, 384), (1280, 720), (1920, 1080), (4032, 3024)]
+
+QUESTION_MIX = QUICK_QUESTIONS + SAMPLE_QUESTIONS
+
+BATCH_SIZES = [1, 4, 8, 16]
+THREADS = [1, 4, 16]
+
+SCENARIOS = ("latency", "cache", "checklist", "throughput", "overload")
+
+# Relative change past which --compare reports a regression
+REGRESSION_THRESHOLD = 0.10
+
+# Absolute changes below these are timer noise, whatever the relative change
+NOISE_FLOOR = {"_ms": 0.5, "_seconds": 0.05, "_mb": 8.0, "_rps": 0.0}
+
+
+# Smooth colour gradients plus blocks and noise, so JPEG sizes and decode
+# times resemble photos rather than flat test cards
+def synthetic_image(width, height, seed=0):
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    pixels = np.empty((height, width, 3), dtype=np.float32)
+    for channel in range(3):
+        fx, fy = rng.uniform(0.5, 4.0, size=2)
+        phase = rng.uniform(0, 2 * np.pi)
+        pixels[..., channel] = 127 + 100 * np.sin(fx * 2 * np.pi * x / width + fy * 2 * np.pi * y / height + phase)
+    for _ in range(6):
+        bw, bh = int(rng.integers(width // 8, width // 3)), int(rng.integers(height // 8, height // 3))
+        left, top = int(rng.integers(0, width - bw)), int(rng.integers(0, height - bh))
+        pixels[top:top + bh, left:left + bw] = rng.uniform(0, 255, size=3)
+    pixels += rng.normal(0, 8, size=pixels.shape)
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+
+def synthetic_upload(width, height, seed=0, quality=90):
+    buffer = io.BytesIO()
+    synthetic_image(width, height, seed).save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+# Peak resident set size of this process so far (ru_maxrss is KiB on Linux,
+# bytes on macOS)
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def latency_stats(seconds, prefix=""):
+    return {
+        f"{prefix}mean_ms": sum(seconds) / len(seconds) * 1000,
+        f"{prefix}p50_ms": percentile(seconds, 50) * 1000,
+        f"{prefix}p95_ms": percentile(seconds, 95) * 1000,
+        f"{prefix}p99_ms": percentile(seconds, 99) * 1000,
+    }
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def start_service(backend, **options):
+    service = VQAService(backend=backend, **options).start()
+    service.load_vqa_model()
+    return service
+
+
+# Upload decode + one answer per request, every request on a new image so
+# neither cache can help
+def bench_latency(service, repeats, seed=0):
+    rows = []
+    for width, height in RESOLUTIONS:
+        uploads = [synthetic_upload(width, height, seed + i) for i in range(repeats)]
+        preprocess, answer = [], []
+        for i, data in enumerate(uploads):
+            prepared, seconds = timed(preprocess_upload, io.BytesIO(data))
+            preprocess.append(seconds)
+            _, seconds = timed(service.answer_question, prepared.model_image, QUESTION_MIX[i % len(QUESTION_MIX)])
+            answer.append(seconds)
+        rows.append({
+            "name": f"latency {width}x{height}",
+            "metrics": {
+                **latency_stats([p + a for p, a in zip(preprocess, answer)]),
+                **latency_stats(preprocess, "preprocess_"),
+                "upload_kb": sum(map(len, uploads)) / len(uploads) / 1024,
+                "peak_rss_mb": peak_rss_mb(),
+            },
+        })
+    return rows
+
+
+# The same image answered cold, with a new question (vision embedding
+# reused), with a repeated question (answer cache), and, with
+# VQA_NEAR_DUPLICATES=1, as a re-encoded, resized copy with the first
+# question (near-duplicate answer reuse)
+def bench_cache(service, repeats, seed=0):
+    cold, embedding_hit, answer_hit, near_duplicate = [], [], [], []
+    for i in range(repeats):
+        image = synthetic_image(384, 384, seed + i)
+        first, second = QUESTION_MIX[i % len(QUESTION_MIX)], QUESTION_MIX[(i + 1) % len(QUESTION_MIX)]
+        cold.append(timed(service.answer_question, image, first)[1])
+        embedding_hit.append(timed(service.answer_question, image, second)[1])
+        answer_hit.append(timed(service.answer_question, image, first)[1])
+        if service.near_duplicates is None:
+            continue
+        copy = Image.open(io.BytesIO(synthetic_upload(384, 384, seed + i, quality=70))).resize((352, 352))
+        near_duplicate.append(timed(service.answer_question, copy, first)[1])
+    paths = [("cold", cold), ("embedding_hit", embedding_hit), ("answer_hit", answer_hit)]
+    if near_duplicate:
+        paths.append(("near_duplicate", near_duplicate))
+    return [
+        {"name": f"cache {path}", "metrics": {**latency_stats(seconds), "peak_rss_mb": peak_rss_mb()}}
+        for path, seconds in paths
+    ]
+
+
+# Every question in the mix about one new image: one call per question
+# versus a single answer_questions call
+def bench_checklist(service, repeats, seed=0):
+    separate, together = [], []
+    for i in range(repeats):
+        image = synthetic_image(384, 384, seed + 2 * i)
+        started = time.perf_counter()
+        for question in QUESTION_MIX:
+            service.answer_question(image, question)
+        separate.append(time.perf_counter() - started)
+        together.append(timed(service.answer_questions, synthetic_image(384, 384, seed + 2 * i + 1), QUESTION_MIX)[1])
+    return [
+        {"name": f"checklist {mode}", "metrics": {**latency_stats(seconds), "peak_rss_mb": peak_rss_mb()}}
+        for mode, seconds in (("separate", separate), ("together", together))
+    ]
+
+
+# Concurrent clients against the micro-batcher: batch size x client threads,
+# distinct images throughout so every request reaches the model
+def bench_throughput(backend, requests, batch_sizes, threads, seed=0, workers=0):
+    rows = []
+    for batch_size in batch_sizes:
+        service = start_service(backend, max_batch_size=batch_size, workers=workers)
+        try:
+            for thread_count in threads:
+                seed += requests
+                work = [
+                    (synthetic_image(384, 384, seed + i), QUESTION_MIX[i % len(QUESTION_MIX)])
+                    for i in range(requests)
+                ]
+                batches_before, requests_before = service.batcher.batches_run, service.batcher.requests_run
+
+                def run(item):
+                    return timed(service.answer_question, *item)[1]
+
+                with ThreadPoolExecutor(max_workers=thread_count) as pool:
+                    started = time.perf_counter()
+                    seconds = list(pool.map(run, work))
+                    elapsed = time.perf_counter() - started
+
+                batches = service.batcher.batches_run - batches_before
+                rows.append({
+                    "name": f"throughput batch={batch_size} threads={thread_count}",
+                    "metrics": {
+                        "throughput_rps": requests / elapsed,
+                        **latency_stats(seconds),
+                        "mean_batch_size": (
+                            (service.batcher.requests_run - requests_before) / batches if batches else 0.0
+                        ),
+                        "peak_rss_mb": peak_rss_mb(),
+                    },
+                })
+        finally:
+            service.close()
+    return rows
+
+
+# One session keeps the queue full of batch-priority bulk requests while
+# interactive clients (a session each) ask single questions. Interactive
+# latency should stay near the idle figure; requests the queue cannot take
+# are refused rather than left to wait.
+def bench_overload(backend, requests, threads, seed=0, workers=0):
+    service = start_service(backend, workers=workers)
+    stop = threading.Event()
+    bulk_images = [synthetic_image(384, 384, seed + i) for i in range(16)]
+    bulk = {"answered": 0, "refused": 0}
+    lock = threading.Lock()
+
+    def flood():
+        round_ = 0
+        while not stop.is_set():
+            # A new question each round, so the answer cache cannot help
+            items = [(image, f"{QUESTION_MIX[round_ % len(QUESTION_MIX)]} ({round_})", None) for image in bulk_images]
+            try:
+                service.answer_many(items, path="bench", session="bulk", priority=BATCH)
+                outcome = "answered"
+            except (QueueFull, DeadlineExceeded):
+                outcome = "refused"
+                time.sleep(0.01)
+            with lock:
+                bulk[outcome] += len(items)
+            round_ += 1
+
+    flooders = [threading.Thread(target=flood, daemon=True) for _ in range(4)]
+    work = [(synthetic_image(384, 384, seed + 100 + i), QUESTION_MIX[i % len(QUESTION_MIX)]) for i in range(requests)]
+    clients = max(threads)
+    refused = []
+
+    def run(args):
+        index, (image, question) = args
+        try:
+            return timed(service.answer_question, image, question, session=f"client-{index % clients}")[1]
+        except (QueueFull, DeadlineExceeded):
+            refused.append(index)
+            return None
+
+    try:
+        for flooder in flooders:
+            flooder.start()
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            seconds = [s for s in pool.map(run, enumerate(work)) if s is not None]
+    finally:
+        stop.set()
+        for flooder in flooders:
+            flooder.join()
+        service.close()
+    values = latency_stats(seconds) if seconds else {}
+    values.update({
+        "refused": len(refused),
+        "bulk_answered": bulk["answered"],
+        "bulk_refused": bulk["refused"],
+        "peak_rss_mb": peak_rss_mb(),
+    })
+    return [{"name": "overload interactive", "metrics": values}]
+
+
+def environment(backend, workers):
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    info = {
+        "backend": backend,
+        "workers": workers,
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        info["torch"] = torch.__version__
+        info["torch_threads"] = torch.get_num_threads()
+    return info
+
+
+def run(backend, scenarios=SCENARIOS, repeats=20, requests=64, batch_sizes=BATCH_SIZES, threads=THREADS, workers=0):
+    results = []
+    load_started = time.perf_counter()
+    service = start_service(backend, workers=workers)
+    results.append({
+        "name": "load",
+        "metrics": {
+            "load_seconds": time.perf_counter() - load_started,
+            "peak_rss_mb": peak_rss_mb(),
+            **service.loader.memory(),
+        },
+    })
+    try:
+        if "latency" in scenarios:
+            results += bench_latency(service, repeats, seed=0)
+        if "cache" in scenarios:
+            results += bench_cache(service, repeats, seed=10_000)
+        if "checklist" in scenarios:
+            results += bench_checklist(service, repeats, seed=15_000)
+    finally:
+        service.close()
+    if "throughput" in scenarios:
+        results += bench_throughput(backend, requests, batch_sizes, threads, seed=20_000, workers=workers)
+    if "overload" in scenarios:
+        results += bench_overload(backend, requests, threads, seed=30_000, workers=workers)
+    return {"environment": environment(backend, workers), "results": results}
+
+
+# Rows of (name, metric, before, after, relative change, regressed). Only
+# metrics with a unit suffix in NOISE_FLOOR are compared; throughput is
+# higher-is-better, everything else lower-is-better.
+def compare(baseline, current, threshold=REGRESSION_THRESHOLD):
+    before = {row["name"]: row["metrics"] for row in baseline["results"]}
+    changes = []
+    for row in current["results"]:
+        for metric, value in row["metrics"].items():
+            suffix = next((suffix for suffix in NOISE_FLOOR if metric.endswith(suffix)), None)
+            old = before.get(row["name"], {}).get(metric)
+            if suffix is None or not old or abs(value - old) <= NOISE_FLOOR[suffix]:
+                continue
+            change = (value - old) / old
+            worse = -change if suffix == "_rps" else change
+            changes.append((row["name"], metric, old, value, change, worse > threshold))
+    return changes
+
+
+def _int_list(text):
+    return [int(value) for value in text.split(",") if value]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark VQA latency, throughput, caching and memory")
+    parser.add_argument("--backend", default="mock", choices=backend_names())
+    parser.add_argument("-o", "--output", default="benchmark.json")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"comma-separated subset of {SCENARIOS}")
+    parser.add_argument("--repeats", type=int, default=20, help="requests per latency/cache measurement")
+    parser.add_argument("--requests", type=int, default=64, help="requests per throughput cell")
+    parser.add_argument("--batch-sizes", type=_int_list, default=BATCH_SIZES)
+    parser.add_argument("--threads", type=_int_list, default=THREADS, help="concurrent client threads")
+    parser.add_argument("--workers", type=int, default=0, help="model worker processes (0 = in-process)")
+    parser.add_argument("--compare", metavar="BASELINE", help="earlier results file to check for regressions")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    scenarios = [name for name in args.scenarios.split(",") if name]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    report = run(args.backend, scenarios, args.repeats, args.requests, args.batch_sizes, args.threads, args.workers)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for row in report["results"]:
+        values = " ".join(f"{metric}={value:.2f}" for metric, value in row["metrics"].items())
+        print(f"{row['name']:<36} {values}")
+
+    if not args.compare:
+        return 0
+    with open(args.compare) as f:
+        baseline = json.load(f)
+    regressions = 0
+    print(f"\nCompared with {args.compare} (commit {baseline['environment'].get('commit')}):")
+    for name, metric, old, new, change, regressed in compare(baseline, report, args.threshold):
+        if regressed:
+            regressions += 1
+        if regressed or abs(change) > args.threshold:
+            marker = "REGRESSION" if regressed else "improved"
+            print(f"  {marker:<10} {name} {metric}: {old:.2f} -> {new:.2f} ({change:+.1%})")
+    print(f"{regressions} regression(s) beyond {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,194 @@
+import csv
+import io
+import json
+import os
+import zipfile
+
+from PIL import UnidentifiedImageError
+
+from prefetching import batched, prefetch
+from preprocessing import preprocess_upload
+from scheduler import BATCH, DeadlineExceeded, QueueFull, queue_indicator
+from session_store import current_session_id
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+# Images per answer_many call; the results grid fills in one batch at a time
+BATCH_SIZE = 16
+
+# Decode threads, and decoded images allowed in flight ahead of the model
+DECODE_WORKERS = 4
+PREFETCH_WINDOW = 32
+
+# Longest side of the JPEG thumbnail kept per result for the grid
+THUMBNAIL_SIZE = 192
+
+EXPORT_FIELDS = ("name", "question", "answer", "confidence", "error")
+
+# Answers below this confidence are flagged in the UI
+LOW_CONFIDENCE = 0.5
+
+
+def is_image_name(name):
+    base = os.path.basename(name)
+    return base.lower().endswith(IMAGE_EXTENSIONS) and not base.startswith("._")
+
+
+# Records for every image among the uploads. Zip archives are expanded
+# lazily: members are only read when their record is decoded.
+def iter_uploads(files):
+    for upload in files:
+        name = getattr(upload, "name", None) or str(upload)
+        if name.lower().endswith(".zip"):
+            archive = zipfile.ZipFile(upload)
+            for info in archive.infolist():
+                if info.is_dir() or "__MACOSX/" in info.filename or not is_image_name(info.filename):
+                    continue
+                yield {"name": f"{name}/{info.filename}", "archive": archive, "member": info}
+        elif is_image_name(name):
+            yield {"name": name, "source": upload}
+
+
+def thumbnail_jpeg(image, size=THUMBNAIL_SIZE):
+    thumbnail = image.copy()
+    thumbnail.thumbnail((size, size))
+    buffer = io.BytesIO()
+    thumbnail.save(buffer, format="JPEG", quality=80)
+    return buffer.getvalue()
+
+
+# Runs on a decode thread: only the model-sized image and a thumbnail
+# survive, the upload bytes and display-sized copy are dropped here
+def _decode(record):
+    try:
+        if "archive" in record:
+            source = io.BytesIO(record["archive"].read(record["member"]))
+        else:
+            source = record["source"]
+            source.seek(0)
+        prepared = preprocess_upload(source)
+        return prepared.model_image, thumbnail_jpeg(prepared.display_image)
+    except UnidentifiedImageError:
+        return ValueError("Could not decode image")
+    except Exception as exc:
+        return exc
+
+
+# Asks one question of every uploaded image and yields a list of result rows
+# per batch, in upload order. At most PREFETCH_WINDOW + batch_size decoded
+# images are alive at once, however many were uploaded. Requests are queued
+# as batch priority, so interactive questions from other sessions go first.
+def answer_uploads(
+    service,
+    files,
+    question,
+    batch_size=BATCH_SIZE,
+    workers=DECODE_WORKERS,
+    window=PREFETCH_WINDOW,
+    session=None,
+    on_wait=None,
+):
+    decoded = prefetch(iter_uploads(files), _decode, workers=workers, window=window)
+    for batch in batched(decoded, batch_size):
+        rows = [{"name": record["name"], "question": question} for record, _ in batch]
+        ready = []
+        for row, (_, result) in zip(rows, batch):
+            if isinstance(result, Exception):
+                row["error"] = str(result)
+            else:
+                row["thumbnail"] = result[1]
+                ready.append((row, result[0]))
+
+        if ready:
+            try:
+                answers = service.answer_many(
+                    [(image, question, None) for _, image in ready],
+                    path="uploads",
+                    session=session,
+                    priority=BATCH,
+                    on_wait=on_wait,
+                )
+            except (QueueFull, DeadlineExceeded):
+                for row, _ in ready:
+                    row["error"] = "The model is busy, try again later"
+            except Exception as exc:
+                for row, _ in ready:
+                    row["error"] = str(exc)
+            else:
+                for (row, _), answer in zip(ready, answers):
+                    row["answer"] = answer["answer"]
+                    row["confidence"] = answer["confidence"]
+        yield rows
+
+
+def to_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+
+def to_jsonl(rows):
+    return "".join(json.dumps({field: row.get(field) for field in EXPORT_FIELDS}) + "\n" for row in rows)
+
+
+# Streamlit results grid, filled in as each batch finishes. Thumbnails are
+# dropped once shown; returns the rows for export.
+def show_upload_grid(service, files, question, columns=4):
+    import streamlit as st
+
+    status = st.empty()
+    grid = st.container()
+    rows = []
+    cells = None
+    status.caption("⏳ Decoding and answering...")
+    for batch in answer_uploads(
+        service, files, question, session=current_session_id(), on_wait=queue_indicator(status)
+    ):
+        for row in batch:
+            if len(rows) % columns == 0:
+                cells = grid.columns(columns)
+            with cells[len(rows) % columns]:
+                thumbnail = row.pop("thumbnail", None)
+                if thumbnail is not None:
+                    st.image(thumbnail, use_column_width=True)
+                if "error" in row:
+                    st.error(f"{row['name']}: {row['error']}")
+                else:
+                    st.caption(f"**{row['name']}**  \n{row['answer']} ({row['confidence']:.0%})")
+            rows.append(row)
+        status.caption(f"⏳ {len(rows)} images answered...")
+    status.caption(f"✅ {len(rows)} images answered")
+    return rows
+
+
+# Streamlit table of answers to many questions about one image, shared by
+# both front ends
+def show_checklist(questions, results):
+    import streamlit as st
+
+    st.dataframe(
+        [
+            {"Question": question, "Answer": result["answer"], "Confidence": result["confidence"]}
+            for question, result in zip(questions, results)
+        ],
+        column_config={
+            "Confidence": st.column_config.ProgressColumn("Confidence", format="%.2f", min_value=0.0, max_value=1.0)
+        },
+        hide_index=True,
+        use_container_width=True,
+    )
+    unsure = sum(result["confidence"] < LOW_CONFIDENCE for result in results)
+    if unsure:
+        st.warning(f"⚠️ The model is unsure about {unsure} of {len(results)} answers.")
+
+
+def show_export_buttons(rows):
+    import streamlit as st
+
+    left, right = st.columns(2)
+    left.download_button("⬇️ Download CSV", to_csv(rows), file_name="answers.csv", mime="text/csv")
+    right.download_button(
+        "⬇️ Download JSONL", to_jsonl(rows), file_name="answers.jsonl", mime="application/x-ndjson"
+    )
@@ -0,0 +1,98 @@
+import argparse
+import json
+import sys
+import time
+
+from PIL import Image, ImageDraw
+
+import vqa_pipeline
+from evaluate import read_manifest
+from preprocessing import preprocess_upload
+
+# Fixed synthetic sample set: simple shapes with unambiguous answers
+_SHAPES = [
+    ("ellipse", (220, 40, 40), "red"),
+    ("rectangle", (40, 90, 220), "blue"),
+    ("ellipse", (40, 170, 60), "green"),
+    ("rectangle", (250, 200, 40), "yellow"),
+]
+_QUESTIONS = [
+    "what color is the shape?",
+    "what shape is in the picture?",
+    "how many shapes are there?",
+    "what color is the background?",
+]
+
+
+def synthetic_samples():
+    samples = []
+    for shape, color, _ in _SHAPES:
+        for count in (1, 2):
+            image = Image.new("RGB", (384, 384), (255, 255, 255))
+            draw = ImageDraw.Draw(image)
+            for i in range(count):
+                left = 40 + i * 170
+                box = (left, 120, left + 140, 260)
+                getattr(draw, shape)(box, fill=color)
+            for question in _QUESTIONS:
+                samples.append((image, question))
+    return samples
+
+
+def load_samples(path):
+    return [(preprocess_upload(record["image"]).model_image, record["question"]) for record in read_manifest(path)]
+
+
+def run_backend(backend, samples, batch_size):
+    processor, model = vqa_pipeline.load_vqa_model(backend=backend)
+    results = []
+    started = time.perf_counter()
+    for start in range(0, len(samples), batch_size):
+        chunk = samples[start:start + batch_size]
+        results += vqa_pipeline.answer_batch(
+            [image for image, _ in chunk], [question for _, question in chunk], processor, model
+        )
+    return results, time.perf_counter() - started
+
+
+# Compare a candidate backend's answers with the fp32 reference answers
+def check_accuracy_drift(backend, samples, reference="fp32", batch_size=8):
+    expected, reference_seconds = run_backend(reference, samples, batch_size)
+    actual, candidate_seconds = run_backend(backend, samples, batch_size)
+
+    mismatches = []
+    confidence_delta = 0.0
+    for (_, question), want, got in zip(samples, expected, actual):
+        confidence_delta += abs(want["confidence"] - got["confidence"])
+        if want["answer"] != got["answer"]:
+            mismatches.append({"question": question, "expected": want["answer"], "actual": got["answer"]})
+
+    return {
+        "backend": backend,
+        "reference": reference,
+        "samples": len(samples),
+        "agreement": 1 - len(mismatches) / len(samples),
+        "mean_confidence_delta": confidence_delta / len(samples),
+        "reference_seconds": reference_seconds,
+        "backend_seconds": candidate_seconds,
+        "speedup": reference_seconds / candidate_seconds if candidate_seconds else None,
+        "mismatches": mismatches,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check answer drift of a VQA backend against fp32")
+    parser.add_argument("--backend", choices=vqa_pipeline.BACKENDS, required=True)
+    parser.add_argument("--samples", help="JSONL/CSV manifest as used by evaluate.py (default: synthetic set)")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--min-agreement", type=float, default=0.95)
+    args = parser.parse_args()
+
+    samples = load_samples(args.samples) if args.samples else synthetic_samples()
+    report = check_accuracy_drift(args.backend, samples, batch_size=args.batch_size)
+    print(json.dumps(report, indent=2))
+    return 0 if report["agreement"] >= args.min_agreement else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+import argparse
+import csv
+import json
+import math
+import os
+import re
+import sys
+import time
+
+from backends import backend_names, create_backend
+from prefetching import batched, prefetch
+from preprocessing import preprocess_upload
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_ARTICLES = {"a", "an", "the"}
+_NUMBERS = {
+    "none": "0", "zero": "0", "one": "1", "two": "2", "three": "3", "four": "4", "five": "5",
+    "six": "6", "seven": "7", "eight": "8", "nine": "9", "ten": "10",
+}
+
+
+# Manifest rows: image path (relative to the manifest), question and optional
+# ground truth as "answer" (string) or "answers" (list; "|"-separated in CSV)
+def read_manifest(path):
+    root = os.path.dirname(os.path.abspath(path))
+    with open(path, newline="") as f:
+        if path.endswith(".csv"):
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+
+        for index, row in enumerate(rows, start=1):
+            answers = row.get("answers") or row.get("answer") or None
+            if isinstance(answers, str):
+                answers = answers.split("|")
+            yield {
+                "id": str(row.get("id") or index),
+                "image": os.path.join(root, row["image"]),
+                "question": row["question"],
+                "answers": answers,
+            }
+
+
+# Runs on a decode thread (see prefetch): the model image, or the exception
+def _load(record):
+    try:
+        return preprocess_upload(record["image"]).model_image
+    except Exception as exc:
+        return exc
+
+
+def normalize_answer(answer):
+    words = _PUNCTUATION.sub("", answer.lower()).split()
+    return " ".join(_NUMBERS.get(word, word) for word in words if word not in _ARTICLES)
+
+
+# Standard VQA accuracy: full credit when at least 3 annotators gave the answer
+def vqa_accuracy(prediction, answers):
+    prediction = normalize_answer(prediction)
+    matches = sum(normalize_answer(answer) == prediction for answer in answers)
+    return min(matches / 3.0, 1.0) if len(answers) >= 3 else float(matches > 0)
+
+
+# Candidate temperatures for fit_temperature: 0.1 to 10, log-spaced
+_TEMPERATURES = [10 ** (i / 50.0) for i in range(-50, 51)]
+
+
+# Mean log loss of confidences against (soft) VQA accuracy
+def log_loss(pairs):
+    total = 0.0
+    for confidence, accuracy in pairs:
+        confidence = min(max(confidence, 1e-6), 1 - 1e-6)
+        total -= accuracy * math.log(confidence) + (1 - accuracy) * math.log(1 - confidence)
+    return total / len(pairs)
+
+
+# Temperature T for confidence = exp(mean log-prob / T) with the lowest log
+# loss on scored rows, found by grid search. Each row's log-prob is recovered
+# from its confidence and the temperature it was produced with. Returns
+# (T, loss), or (None, None) without scored rows.
+def fit_temperature(rows):
+    points = [
+        (math.log(max(row["confidence"], 1e-12)) * row.get("temperature", 1.0), row["accuracy"])
+        for row in rows
+        if "accuracy" in row
+    ]
+    if not points:
+        return None, None
+    losses = {
+        temperature: log_loss([(math.exp(log_prob / temperature), accuracy) for log_prob, accuracy in points])
+        for temperature in _TEMPERATURES
+    }
+    best = min(losses, key=losses.get)
+    return best, losses[best]
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(round(q / 100.0 * (len(ordered) - 1))), len(ordered) - 1)]
+
+
+def completed_ids(output):
+    if not os.path.exists(output):
+        return set()
+    with open(output) as f:
+        return {json.loads(line)["id"] for line in f if line.strip()}
+
+
+def evaluate(manifest, output, backend="blip", batch_size=8, workers=4, resume=False):
+    done = completed_ids(output) if resume else set()
+    records = (record for record in read_manifest(manifest) if record["id"] not in done)
+    model = create_backend(backend)
+    model.load()
+
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    with open(output, "a" if resume else "w") as out:
+        for batch in batched(prefetch(records, _load, workers=workers, window=batch_size * 4), batch_size):
+            ready = [(record, image) for record, image in batch if not isinstance(image, Exception)]
+            for record, image in batch:
+                if isinstance(image, Exception):
+                    errors += 1
+                    out.write(json.dumps({"id": record["id"], "image": record["image"], "error": str(image)}) + "\n")
+
+            if ready:
+                batch_started = time.perf_counter()
+                results = model.answer_batch([image for _, image in ready], [record["question"] for record, _ in ready])
+                # Model time per answer: the batch's time split across its answers
+                latency = (time.perf_counter() - batch_started) / len(ready)
+
+                for (record, _), result in zip(ready, results):
+                    latencies.append(latency)
+                    row = {
+                        "id": record["id"],
+                        "image": record["image"],
+                        "question": record["question"],
+                        "answer": result["answer"],
+                        "confidence": result["confidence"],
+                        "temperature": model.temperature,
+                        "latency_ms": latency * 1000,
+                        "batch_size": len(ready),
+                    }
+                    if record["answers"]:
+                        row["expected"] = record["answers"]
+                        row["accuracy"] = vqa_accuracy(result["answer"], record["answers"])
+                    out.write(json.dumps(row) + "\n")
+            out.flush()
+
+    elapsed = time.perf_counter() - started
+    return summarize(output, latencies, errors, elapsed, skipped=len(done))
+
+
+# Throughput and latency cover this run; accuracy and calibration cover the
+# whole output file. Set VQA_CONFIDENCE_TEMPERATURE to fitted_temperature to
+# serve calibrated confidences.
+def summarize(output, latencies, errors, elapsed, skipped=0):
+    with open(output) as f:
+        scored = [row for row in map(json.loads, filter(str.strip, f)) if "accuracy" in row]
+    scores = [row["accuracy"] for row in scored]
+    temperature, fitted_loss = fit_temperature(scored)
+    return {
+        "answered": len(latencies),
+        "errors": errors,
+        "skipped": skipped,
+        "seconds": elapsed,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "latency_p50_ms": (percentile(latencies, 50) or 0.0) * 1000,
+        "latency_p95_ms": (percentile(latencies, 95) or 0.0) * 1000,
+        "vqa_accuracy": sum(scores) / len(scores) if scores else None,
+        "scored": len(scores),
+        "confidence_log_loss": log_loss([(row["confidence"], row["accuracy"]) for row in scored]) if scored else None,
+        "fitted_temperature": temperature,
+        "fitted_log_loss": fitted_loss,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the VQA pipeline over an image/question manifest")
+    parser.add_argument("manifest", help="JSONL or CSV with image, question and optional answer(s)")
+    parser.add_argument("-o", "--output", default="results.jsonl")
+    parser.add_argument("--backend", default="blip", choices=backend_names())
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=4, help="image decode threads")
+    parser.add_argument("--resume", action="store_true", help="skip ids already in the output file")
+    args = parser.parse_args()
+
+    summary = evaluate(args.manifest, args.output, args.backend, args.batch_size, args.workers, args.resume)
+    print(json.dumps(summary, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+import io
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+# Anchor colours for a blue -> cyan -> yellow -> red heatmap
+_COLORMAP_STOPS = np.array([0.0, 0.35, 0.65, 1.0])
+_COLORMAP_COLORS = np.array([
+    [30, 60, 200],
+    [78, 205, 196],
+    [254, 202, 87],
+    [255, 70, 70],
+], dtype=np.float32)
+
+
+# Attention rollout through the BLIP text encoder. self_attentions is
+# [layers, batch, tokens, tokens] and cross_attentions is
+# [layers, batch, tokens, patches], both averaged over heads. Each layer mixes
+# tokens through self-attention (with the residual path) and then adds what
+# the tokens read from the image through cross-attention.
+def cross_attention_rollout(self_attentions, cross_attentions, token_mask):
+    layers, batch, tokens, _ = self_attentions.shape
+    eye = np.eye(tokens, dtype=np.float32)
+
+    relevance = np.zeros((batch, tokens, cross_attentions.shape[-1]), dtype=np.float32)
+    for layer in range(layers):
+        mixing = 0.5 * self_attentions[layer] + 0.5 * eye
+        mixing /= mixing.sum(axis=-1, keepdims=True)
+        relevance = mixing @ relevance + cross_attentions[layer]
+
+    weights = token_mask.astype(np.float32)
+    weights /= np.maximum(weights.sum(axis=-1, keepdims=True), 1.0)
+    return np.einsum("bt,btp->bp", weights, relevance)
+
+
+# Drop the CLS position, reshape patches to a square grid and scale to [0, 1]
+def patch_grids(relevance):
+    patches = relevance[:, 1:]
+    side = int(round(np.sqrt(patches.shape[-1])))
+    grids = patches.reshape(-1, side, side)
+    low = grids.min(axis=(1, 2), keepdims=True)
+    high = grids.max(axis=(1, 2), keepdims=True)
+    return (grids - low) / np.maximum(high - low, 1e-8)
+
+
+def apply_colormap(values):
+    flat = values.ravel()
+    channels = [np.interp(flat, _COLORMAP_STOPS, _COLORMAP_COLORS[:, c]) for c in range(3)]
+    return np.stack(channels, axis=-1).reshape(values.shape + (3,)).astype(np.uint8)
+
+
+# Upsample a patch grid onto the image and blend it in, returning PNG bytes
+def overlay_png(image, grid, alpha=0.45, max_side=512):
+    base = image.convert("RGB")
+    base.thumbnail((max_side, max_side))
+
+    heat = Image.fromarray((np.asarray(grid, dtype=np.float32) * 255).astype(np.uint8), mode="L")
+    heat = np.asarray(heat.resize(base.size, Image.BILINEAR), dtype=np.float32) / 255.0
+    colored = apply_colormap(heat).astype(np.float32)
+
+    blended = (1 - alpha) * np.asarray(base, dtype=np.float32) + alpha * colored
+    buffer = io.BytesIO()
+    Image.fromarray(blended.astype(np.uint8)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+# Renders heatmap overlays, caching the PNG per (image, question) key and
+# image size
+class HeatmapExplainer:
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    # The same answer is drawn on display images of different sizes
+    def overlay(self, key, image, grid):
+        key = (key, image.size)
+        with self._lock:
+            png = self._entries.get(key)
+            if png is not None:
+                self._entries.move_to_end(key)
+                return png
+
+        png = overlay_png(image, grid)
+        with self._lock:
+            self._entries[key] = png
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return png
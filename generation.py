@@ -0,0 +1,110 @@
+import os
+import threading
+from collections import namedtuple
+
+import metrics
+from question_router import classify_many
+
+# fast: greedy decoding, no alternative answers; quality: beam search
+FAST = "fast"
+QUALITY = "quality"
+GENERATION_MODE = os.environ.get("VQA_GENERATION_MODE", QUALITY)
+
+# Beams searched in quality mode; top_k of them come back as alternatives
+QUALITY_BEAMS = 3
+
+# New tokens allowed per answer by question category (None: no keyword
+# matched). VQA answers are mostly one to three tokens; generation still
+# stops earlier once every sequence has produced EOS.
+ANSWER_TOKEN_CAPS = {
+    "color": 4,
+    "people": 3,
+    "object": 6,
+    "location": 6,
+    "activity": 8,
+    None: 10,
+}
+MAX_NEW_TOKENS = 20
+
+# When the requests queued ahead would take longer than this to clear,
+# decoding drops to greedy; past twice the budget answers are also cut to
+# DOWNGRADED_TOKEN_CAP tokens
+LATENCY_BUDGET_MS = float(os.environ.get("VQA_LATENCY_BUDGET_MS", "2000"))
+DOWNGRADED_TOKEN_CAP = 4
+
+# Weight of the newest batch in the moving average of seconds per request
+_SMOOTHING = 0.2
+
+# Decoding settings for one generate call
+GenerationSettings = namedtuple(
+    "GenerationSettings", ["mode", "num_beams", "num_return_sequences", "max_new_tokens", "downgraded"]
+)
+
+
+# Settings that ignore the policy: greedy unless top_k asks for alternatives
+def fixed_settings(top_k=0, max_new_tokens=MAX_NEW_TOKENS):
+    beams = max(top_k, 1)
+    return GenerationSettings(QUALITY if beams > 1 else FAST, beams, beams, max_new_tokens, False)
+
+
+# Picks decoding settings per batch from the mode, the question categories and
+# how deep the queue is. queue_depth is a callable returning the number of
+# requests waiting (set by whoever owns the queue, 0 by default); the time
+# each request takes is learned from record().
+class GenerationPolicy:
+    def __init__(
+        self,
+        mode=GENERATION_MODE,
+        top_k=0,
+        num_beams=QUALITY_BEAMS,
+        token_caps=ANSWER_TOKEN_CAPS,
+        max_new_tokens=MAX_NEW_TOKENS,
+        latency_budget_ms=LATENCY_BUDGET_MS,
+    ):
+        if mode not in (FAST, QUALITY):
+            raise ValueError(f"Unknown generation mode {mode!r}, expected {FAST!r} or {QUALITY!r}")
+        self.mode = mode
+        self.top_k = top_k
+        self.num_beams = max(num_beams, 1)
+        self.token_caps = token_caps
+        self.max_new_tokens = max_new_tokens
+        self.latency_budget = latency_budget_ms / 1000.0
+        self.queue_depth = lambda: 0
+        self._request_seconds = None
+        self._lock = threading.Lock()
+
+    # Expected seconds until the queued requests are answered
+    def estimated_wait(self):
+        with self._lock:
+            per_request = self._request_seconds
+        return self.queue_depth() * per_request if per_request else 0.0
+
+    # One padded generate call serves the whole batch, so the batch gets the
+    # largest cap among its questions
+    def settings(self, questions, streaming=False):
+        caps = [self.token_caps.get(category, self.token_caps[None]) for category in classify_many(questions)]
+        max_new_tokens = min(max(caps, default=self.max_new_tokens), self.max_new_tokens)
+        beams = self.num_beams if self.mode == QUALITY and not streaming else 1
+
+        wait = self.estimated_wait()
+        downgraded = False
+        if wait > self.latency_budget and beams > 1:
+            beams = 1
+            downgraded = True
+        if wait > 2 * self.latency_budget and max_new_tokens > DOWNGRADED_TOKEN_CAP:
+            max_new_tokens = DOWNGRADED_TOKEN_CAP
+            downgraded = True
+        if downgraded:
+            metrics.inc("vqa_generation_downgrades_total", len(questions))
+
+        mode = QUALITY if beams > 1 else FAST
+        return GenerationSettings(mode, beams, min(max(self.top_k, 1), beams), max_new_tokens, downgraded)
+
+    # Feeds the time a batch of `requests` took into the queue-wait estimate
+    def record(self, seconds, requests):
+        per_request = seconds / max(requests, 1)
+        with self._lock:
+            if self._request_seconds is None:
+                self._request_seconds = per_request
+            else:
+                self._request_seconds += _SMOOTHING * (per_request - self._request_seconds)
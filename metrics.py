@@ -0,0 +1,191 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+# Set VQA_METRICS=0 to turn instrumentation into no-ops
+ENABLED = os.environ.get("VQA_METRICS", "1") != "0"
+
+# Observations kept per series for quantiles (a sliding window)
+WINDOW = 2048
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+_NOOP = nullcontext()
+
+
+def _quantile(ordered, q):
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class _Summary:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.window = deque(maxlen=WINDOW)
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        self.window.append(value)
+
+    def quantiles(self):
+        ordered = sorted(self.window)
+        if not ordered:
+            return {q: None for q in QUANTILES}
+        return {q: _quantile(ordered, q) for q in QUANTILES}
+
+
+# Counters and summaries (count, sum, p50/p95/p99 over a sliding window),
+# keyed by metric name plus labels. Collectors are callables run at scrape
+# time that return {(name, labels): value} gauges, e.g. cache sizes.
+class MetricsRegistry:
+    def __init__(self, enabled=ENABLED):
+        self.enabled = enabled
+        self._counters = {}
+        self._summaries = {}
+        self._collectors = []
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def inc(self, name, amount=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is None:
+                summary = self._summaries[key] = _Summary()
+            summary.observe(value)
+
+    def timer(self, name, **labels):
+        if not self.enabled:
+            return _NOOP
+        return self._timer(name, labels)
+
+    @contextmanager
+    def _timer(self, name, labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def timed(self, name, **labels):
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return fn(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def register_collector(self, collector):
+        self._collectors.append(collector)
+
+    def unregister_collector(self, collector):
+        if collector in self._collectors:
+            self._collectors.remove(collector)
+
+    def _gauges(self):
+        gauges = {}
+        for collector in self._collectors:
+            gauges.update(collector())
+        return gauges
+
+    # Rows for the UI debug panel (summary values in the metric's own unit)
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self._counters)
+            summaries = {key: (s.count, s.total, s.quantiles()) for key, s in self._summaries.items()}
+
+        rows = []
+        for (name, labels), value in sorted(counters.items()):
+            rows.append({"metric": name + _format_labels(labels), "count": value})
+        for (name, labels), (count, total, quantiles) in sorted(summaries.items()):
+            rows.append({
+                "metric": name + _format_labels(labels),
+                "count": count,
+                "mean": total / count if count else None,
+                "p50": quantiles[0.5],
+                "p95": quantiles[0.95],
+                "p99": quantiles[0.99],
+            })
+        for (name, labels), value in sorted(self._gauges().items()):
+            rows.append({"metric": name + _format_labels(labels), "value": value})
+        return rows
+
+    # Prometheus text exposition format (version 0.0.4)
+    def render(self):
+        with self._lock:
+            counters = dict(self._counters)
+            summaries = {key: (s.count, s.total, s.quantiles()) for key, s in self._summaries.items()}
+
+        lines = []
+        seen = set()
+
+        def header(name, kind):
+            if name not in seen:
+                seen.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(counters.items()):
+            header(name, "counter")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), (count, total, quantiles) in sorted(summaries.items()):
+            header(name, "summary")
+            for q, value in quantiles.items():
+                if value is not None:
+                    lines.append(f"{name}{_format_labels(labels + (('quantile', q),))} {value}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        for (name, labels), value in sorted(self._gauges().items()):
+            header(name, "gauge")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+REGISTRY.describe("vqa_requests_total", "Questions answered, by path and outcome")
+REGISTRY.describe("vqa_request_seconds", "End-to-end answer latency")
+REGISTRY.describe("vqa_stage_seconds", "Latency of each pipeline stage")
+REGISTRY.describe("vqa_batch_size", "Requests per model batch")
+REGISTRY.describe("vqa_answer_cache_total", "Answer cache lookups by result")
+REGISTRY.describe("vqa_errors_total", "Failed requests by stage")
+REGISTRY.describe("vqa_decode_steps", "Tokens generated per answer, by decoding mode")
+REGISTRY.describe("vqa_generation_downgrades_total", "Requests decoded more cheaply due to queue depth")
+REGISTRY.describe("vqa_queue_wait_seconds", "Time requests waited in the scheduler, by priority")
+REGISTRY.describe("vqa_queue_rejected_total", "Requests refused because the scheduler queue was full")
+REGISTRY.describe("vqa_queue_dropped_total", "Queued requests dropped before running, by reason")
+REGISTRY.describe("vqa_queue_depth", "Requests waiting in the scheduler, by priority")
+REGISTRY.describe("vqa_near_duplicate_total", "Images matched to an earlier near-identical image, or new")
+REGISTRY.describe("vqa_ui_reruns_total", "Streamlit script reruns")
+REGISTRY.describe("vqa_ui_css_bytes_total", "Stylesheet bytes sent to browsers")
+
+inc = REGISTRY.inc
+observe = REGISTRY.observe
+timer = REGISTRY.timer
+timed = REGISTRY.timed
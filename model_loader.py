@@ -0,0 +1,101 @@
+import resource
+import sys
+import threading
+import time
+
+# Reference point for cold-start timings (this module is imported on first run)
+PROCESS_START = time.perf_counter()
+
+PENDING = "pending"
+IMPORTING = "importing"
+LOADING = "loading"
+WARMING_UP = "warming_up"
+READY = "ready"
+FAILED = "failed"
+
+
+# Resident memory of this process in MB. On Linux it is split into anonymous
+# (private heap) and file-backed pages; memory-mapped weights count as the
+# latter and are shared with every other process mapping the same file.
+def memory_mb():
+    try:
+        with open("/proc/self/status") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return {
+            name: int(fields[key].split()[0]) / 1024
+            for name, key in (("rss_mb", "VmRSS"), ("rss_anon_mb", "RssAnon"), ("rss_file_mb", "RssFile"))
+            if key in fields
+        }
+    except OSError:
+        # Peak rather than current RSS (ru_maxrss is KiB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {"rss_mb": peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024}
+
+
+# Imports the backend's heavy modules (torch/transformers) and loads its model
+# on a background thread, so the UI can render while it happens
+class ModelLoader:
+    def __init__(self, backend, warmup=True):
+        self.backend = backend
+        self.warmup = warmup
+        self.state = PENDING
+        self.error = None
+        self._timings = {}
+        self._memory = {}
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def ready(self):
+        return self.state == READY
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="vqa-model-loader", daemon=True)
+                self._thread.start()
+        return self
+
+    # Blocks until the backend is loaded and returns it
+    def wait(self, timeout=None):
+        self.start()
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"Model still {self.state} after {timeout}s")
+        if self.error is not None:
+            raise RuntimeError("Model failed to load") from self.error
+        return self.backend
+
+    def mark_first_paint(self):
+        self._timings.setdefault("first_paint", time.perf_counter() - PROCESS_START)
+
+    def timings(self):
+        return dict(self._timings)
+
+    # Process memory right after the model loaded (see memory_mb)
+    def memory(self):
+        return dict(self._memory)
+
+    def _timed(self, name, fn, *args, **kwargs):
+        started = time.perf_counter()
+        result = fn(*args, **kwargs)
+        self._timings[name] = time.perf_counter() - started
+        return result
+
+    def _run(self):
+        try:
+            self.state = IMPORTING
+            self._timed("import", self.backend.import_modules)
+            self.state = LOADING
+            self._timed("load", self.backend.load)
+            self._memory = memory_mb()
+            if self.warmup:
+                self.state = WARMING_UP
+                self._timed("warmup", self.backend.warmup)
+            self._timings["ready"] = time.perf_counter() - PROCESS_START
+            self.state = READY
+        except Exception as exc:
+            self.error = exc
+            self.state = FAILED
+        finally:
+            self._done.set()
@@ -0,0 +1,199 @@
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+
+MANIFEST = "manifest.json"
+MANIFEST_FORMAT = 1
+
+# Checks run on every load: "size" compares file sizes with the manifest,
+# "sha256" re-hashes every file (slow for the ~1.5 GB of BLIP weights)
+VERIFY = os.environ.get("VQA_MODEL_VERIFY", "size")
+
+# safetensors dtype names -> torch dtype attribute names
+_DTYPES = {
+    "F64": "float64", "F32": "float32", "F16": "float16", "BF16": "bfloat16",
+    "I64": "int64", "I32": "int32", "I16": "int16", "I8": "int8", "U8": "uint8", "BOOL": "bool",
+}
+
+
+class ModelStoreError(RuntimeError):
+    pass
+
+
+def sha256_file(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _store_files(store_dir):
+    return sorted(
+        name for name in os.listdir(store_dir)
+        if name != MANIFEST and not name.endswith(".tmp") and os.path.isfile(os.path.join(store_dir, name))
+    )
+
+
+def write_manifest(store_dir, model_name):
+    manifest = {
+        "format": MANIFEST_FORMAT,
+        "model_name": model_name,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "files": {
+            name: {"bytes": os.path.getsize(path), "sha256": sha256_file(path)}
+            for name, path in ((name, os.path.join(store_dir, name)) for name in _store_files(store_dir))
+        },
+    }
+    path = os.path.join(store_dir, MANIFEST)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+    return manifest
+
+
+# Checks the store against its manifest and returns the manifest. Raises
+# ModelStoreError listing every missing, resized or (with full) changed file.
+def verify(store_dir, full=False):
+    path = os.path.join(store_dir, MANIFEST)
+    if not os.path.exists(path):
+        raise ModelStoreError(f"No {MANIFEST} in {store_dir}; run `python model_store.py convert {store_dir}`")
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get("format") != MANIFEST_FORMAT:
+        raise ModelStoreError(f"Unsupported model store format {manifest.get('format')!r} in {store_dir}")
+
+    problems = []
+    for name, expected in manifest["files"].items():
+        file_path = os.path.join(store_dir, name)
+        if not os.path.exists(file_path):
+            problems.append(f"{name} is missing")
+        elif os.path.getsize(file_path) != expected["bytes"]:
+            problems.append(f"{name} is {os.path.getsize(file_path)} bytes, expected {expected['bytes']}")
+        elif full and sha256_file(file_path) != expected["sha256"]:
+            problems.append(f"{name} does not match its sha256")
+    if problems:
+        raise ModelStoreError(f"Model store {store_dir} is damaged: " + "; ".join(problems))
+    return manifest
+
+
+# One-time download of a Hugging Face model into store_dir: processor files,
+# config and the weights as a single model.safetensors, plus the manifest
+def convert(store_dir, model_name=None):
+    from transformers import BlipForQuestionAnswering, BlipProcessor
+
+    if model_name is None:
+        from vqa_pipeline import MODEL_NAME as model_name
+
+    os.makedirs(store_dir, exist_ok=True)
+    BlipProcessor.from_pretrained(model_name).save_pretrained(store_dir)
+    model = BlipForQuestionAnswering.from_pretrained(model_name)
+    model.save_pretrained(store_dir, safe_serialization=True, max_shard_size="100GB")
+    return write_manifest(store_dir, model_name)
+
+
+# Tensors of a .safetensors file viewing a private (copy-on-write) mapping of
+# it: nothing is read until used, and every process that maps the file shares
+# the same page-cache pages
+def mmap_safetensors(path):
+    import torch
+
+    with open(path, "rb") as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    (header_size,) = struct.unpack("<Q", mapping[:8])
+    header = json.loads(mapping[8:8 + header_size])
+    data_start = 8 + header_size
+
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = getattr(torch, _DTYPES[info["dtype"]])
+        start, end = info["data_offsets"]
+        count = (end - start) // torch.empty((), dtype=dtype).element_size()
+        if count == 0:
+            tensors[name] = torch.empty(info["shape"], dtype=dtype)
+        else:
+            tensor = torch.frombuffer(mapping, dtype=dtype, count=count, offset=data_start + start)
+            tensors[name] = tensor.view(info["shape"])
+    return tensors
+
+
+# BLIP processor and model from a local store, without network access. The
+# model is built without initialising its weights, which are then replaced by
+# the memory-mapped tensors (load_state_dict(assign=True)), so no copy of the
+# weights is made on the heap.
+def load(store_dir, verify_mode=None):
+    verify_mode = verify_mode or VERIFY
+    verify(store_dir, full=verify_mode == "sha256")
+
+    from transformers import BlipConfig, BlipForQuestionAnswering, BlipProcessor
+    from transformers.modeling_utils import no_init_weights
+
+    processor = BlipProcessor.from_pretrained(store_dir, local_files_only=True)
+    config = BlipConfig.from_pretrained(store_dir, local_files_only=True)
+    with no_init_weights():
+        model = BlipForQuestionAnswering(config)
+
+    state = {}
+    for name in _store_files(store_dir):
+        if name.endswith(".safetensors"):
+            state.update(mmap_safetensors(os.path.join(store_dir, name)))
+    if not state:
+        raise ModelStoreError(f"No .safetensors weights in {store_dir}")
+    missing, _ = model.load_state_dict(state, strict=False, assign=True)
+    model.tie_weights()
+
+    # Tied weights are saved once; anything else missing would be left
+    # uninitialised
+    loaded = {tensor.untyped_storage().data_ptr() for tensor in state.values()}
+    tensors = dict(model.named_parameters())
+    tensors.update(model.named_buffers())
+    untied = [key for key in missing if tensors[key].untyped_storage().data_ptr() not in loaded]
+    if untied:
+        raise ModelStoreError(f"Model store {store_dir} has no weights for {', '.join(untied)}")
+    return processor, model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local safetensors model store for offline VQA nodes")
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert_parser = commands.add_parser("convert", help="download a model into a store (needs network once)")
+    convert_parser.add_argument("store_dir")
+    convert_parser.add_argument("--model", default=None, help="Hugging Face model name (default: BLIP VQA base)")
+    verify_parser = commands.add_parser("verify", help="check a store against its manifest")
+    verify_parser.add_argument("store_dir")
+    verify_parser.add_argument("--full", action="store_true", help="re-hash every file")
+    load_parser = commands.add_parser("load", help="load a store and report load time and memory")
+    load_parser.add_argument("store_dir")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "convert":
+            manifest = convert(args.store_dir, args.model)
+            size = sum(entry["bytes"] for entry in manifest["files"].values())
+            print(f"Wrote {len(manifest['files'])} files ({size / 2**20:.0f} MB) to {args.store_dir}")
+        elif args.command == "verify":
+            manifest = verify(args.store_dir, full=args.full)
+            print(f"{args.store_dir}: {len(manifest['files'])} files OK ({manifest['model_name']})")
+        else:
+            from model_loader import memory_mb
+
+            started = time.perf_counter()
+            load(args.store_dir)
+            memory = memory_mb()
+            seconds = time.perf_counter() - started
+            print(f"Loaded in {seconds:.2f}s; " + ", ".join(f"{name} {value:.0f}" for name, value in memory.items()))
+    except ModelStoreError as exc:
+        print(exc, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+import metrics
+
+# Off by default: a near-duplicate is served the earlier image's answers.
+# Set VQA_NEAR_DUPLICATES=1 to turn it on; otherwise only pixel-identical
+# images share work.
+ENABLED = os.environ.get("VQA_NEAR_DUPLICATES", "0") == "1"
+
+# Largest Hamming distance (of 64 bits) at which two images count as the same
+# picture. Both hashes must agree: pHash survives re-encoding and resizing,
+# dHash catches images whose low frequencies match but whose edges do not.
+PHASH_MAX_DISTANCE = int(os.environ.get("VQA_PHASH_MAX_DISTANCE", "6"))
+DHASH_MAX_DISTANCE = int(os.environ.get("VQA_DHASH_MAX_DISTANCE", "10"))
+
+# Both hashes are greyscale, so a red and a blue car look the same to them.
+# Matches must also agree on the mean R, G and B of every cell of a
+# COLOR_GRID x COLOR_GRID grid, to within COLOR_MAX_DISTANCE (of 255).
+COLOR_GRID = 4
+COLOR_MAX_DISTANCE = int(os.environ.get("VQA_COLOR_MAX_DISTANCE", "24"))
+
+# Images remembered; the oldest quarter is forgotten when this is exceeded
+INDEX_SIZE = 100_000
+
+# pHash keeps the lowest HASH_SIZE x HASH_SIZE DCT coefficients of a
+# DCT_SIZE x DCT_SIZE greyscale thumbnail
+HASH_SIZE = 8
+DCT_SIZE = 32
+
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    x = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * x + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+_DCT = _dct_matrix(DCT_SIZE)
+_BIT_WEIGHTS = 1 << np.arange(HASH_SIZE * HASH_SIZE - 1, -1, -1, dtype=np.uint64)
+
+
+def _pack(bits):
+    return int(np.sum(_BIT_WEIGHTS[bits.ravel()], dtype=np.uint64))
+
+
+def _grey(image, size):
+    return np.asarray(image.convert("L").resize(size, Image.BILINEAR), dtype=np.float32)
+
+
+# 64-bit DCT hash: which low-frequency coefficients are above their median
+def phash(image):
+    pixels = _grey(image, (DCT_SIZE, DCT_SIZE))
+    coefficients = (_DCT @ pixels @ _DCT.T)[:HASH_SIZE, :HASH_SIZE]
+    # The DC term only encodes overall brightness
+    return _pack(coefficients > np.median(coefficients.ravel()[1:]))
+
+
+# 64-bit difference hash: whether each pixel is brighter than its right neighbour
+def dhash(image):
+    pixels = _grey(image, (HASH_SIZE + 1, HASH_SIZE))
+    return _pack(pixels[:, 1:] > pixels[:, :-1])
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+# Coarse colour layout: mean R, G and B of each grid cell
+def color_signature(image):
+    cells = image.convert("RGB").resize((COLOR_GRID, COLOR_GRID), Image.BOX)
+    return np.asarray(cells, dtype=np.int16)
+
+
+# Largest difference in any channel of any cell
+def color_distance(a, b):
+    return int(np.abs(a - b).max())
+
+
+# Burkhard-Keller tree over 64-bit hashes: finds every hash within a Hamming
+# radius without comparing against all of them
+class BKTree:
+    def __init__(self):
+        self._root = None
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, value, item):
+        node = [value, item, {}]
+        self._size += 1
+        if self._root is None:
+            self._root = node
+            return
+        current = self._root
+        while True:
+            distance = hamming(value, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    # (distance, item) pairs within radius of value
+    def search(self, value, radius):
+        found = []
+        pending = [self._root] if self._root is not None else []
+        while pending:
+            node_value, item, children = pending.pop()
+            distance = hamming(value, node_value)
+            if distance <= radius:
+                found.append((distance, item))
+            for child_distance, child in children.items():
+                if distance - radius <= child_distance <= distance + radius:
+                    pending.append(child)
+        return found
+
+
+# Maps each image to the key of the first earlier image that looks the same
+# (within both Hamming thresholds and the colour threshold), or to its own
+# key when there is none.
+# Callers cache answers and embeddings under the returned key, so a
+# re-encoded or resized copy reuses the original's work.
+class NearDuplicateIndex:
+    def __init__(
+        self,
+        phash_distance=PHASH_MAX_DISTANCE,
+        dhash_distance=DHASH_MAX_DISTANCE,
+        color_distance=COLOR_MAX_DISTANCE,
+        max_entries=INDEX_SIZE,
+    ):
+        self.phash_distance = phash_distance
+        self.dhash_distance = dhash_distance
+        self.color_distance = color_distance
+        self.max_entries = max_entries
+        self.matches = 0
+        self.misses = 0
+        # exact key -> (canonical key, phash, dhash, colour signature), oldest first
+        self._entries = OrderedDict()
+        self._tree = BKTree()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def canonical(self, image, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                return entry[0]
+
+        image_phash, image_dhash, image_color = phash(image), dhash(image), color_signature(image)
+        with self._lock:
+            best = None
+            for distance, candidate in self._tree.search(image_phash, self.phash_distance):
+                entry = self._entries.get(candidate)
+                if entry is None:
+                    continue
+                canonical, _, candidate_dhash, candidate_color = entry
+                if hamming(image_dhash, candidate_dhash) > self.dhash_distance:
+                    continue
+                if color_distance(image_color, candidate_color) > self.color_distance:
+                    continue
+                if best is None or distance < best[0]:
+                    best = (distance, canonical)
+
+            if best is None:
+                canonical = key
+                self.misses += 1
+                metrics.inc("vqa_near_duplicate_total", result="new")
+                self._tree.add(image_phash, key)
+            else:
+                canonical = best[1]
+                self.matches += 1
+                metrics.inc("vqa_near_duplicate_total", result="match")
+            self._entries[key] = (canonical, image_phash, image_dhash, image_color)
+            if len(self._entries) > self.max_entries:
+                self._forget()
+            return canonical
+
+    # Drops the oldest quarter of the images; the tree is rebuilt from the
+    # rest (BK-trees do not support removal)
+    def _forget(self):
+        for _ in range(len(self._entries) // 4):
+            self._entries.popitem(last=False)
+        self._tree = BKTree()
+        for key, (canonical, image_phash, _, _) in self._entries.items():
+            if canonical == key:
+                self._tree.add(image_phash, key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.matches + self.misses
+            return {
+                "entries": len(self._entries),
+                "canonical": len(self._tree),
+                "matches": self.matches,
+                "misses": self.misses,
+                "match_rate": self.matches / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,126 @@
+import os
+from types import SimpleNamespace
+
+import onnxruntime as ort
+import torch
+
+DEFAULT_ONNX_DIR = "onnx_models"
+
+
+class _VisionExport(torch.nn.Module):
+    def __init__(self, vision_model):
+        super().__init__()
+        self.vision_model = vision_model
+
+    def forward(self, pixel_values):
+        return self.vision_model(pixel_values=pixel_values, return_dict=True).last_hidden_state
+
+
+# The attentions are always exported so the explainer works on this backend too
+class _TextEncoderExport(torch.nn.Module):
+    def __init__(self, text_encoder):
+        super().__init__()
+        self.text_encoder = text_encoder
+
+    def forward(self, input_ids, attention_mask, encoder_hidden_states):
+        encoder_attention_mask = torch.ones(encoder_hidden_states.shape[:-1], dtype=torch.long)
+        outputs = self.text_encoder(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            encoder_hidden_states=encoder_hidden_states,
+            encoder_attention_mask=encoder_attention_mask,
+            output_attentions=True,
+            return_dict=True,
+        )
+        return outputs.last_hidden_state, torch.stack(outputs.attentions), torch.stack(outputs.cross_attentions)
+
+
+def export_onnx(model, onnx_dir):
+    os.makedirs(onnx_dir, exist_ok=True)
+    image_size = model.config.vision_config.image_size
+    hidden_size = model.config.vision_config.hidden_size
+    pixel_values = torch.zeros(1, 3, image_size, image_size)
+    input_ids = torch.ones(1, 8, dtype=torch.long)
+    attention_mask = torch.ones(1, 8, dtype=torch.long)
+    patches = (image_size // model.config.vision_config.patch_size) ** 2 + 1
+    image_embeds = torch.zeros(1, patches, hidden_size)
+
+    with torch.no_grad():
+        torch.onnx.export(
+            _VisionExport(model.vision_model),
+            (pixel_values,),
+            os.path.join(onnx_dir, "vision_encoder.onnx"),
+            input_names=["pixel_values"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "last_hidden_state": {0: "batch"}},
+            opset_version=17,
+        )
+        torch.onnx.export(
+            _TextEncoderExport(model.text_encoder),
+            (input_ids, attention_mask, image_embeds),
+            os.path.join(onnx_dir, "text_encoder.onnx"),
+            input_names=["input_ids", "attention_mask", "encoder_hidden_states"],
+            output_names=["last_hidden_state", "attentions", "cross_attentions"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "tokens"},
+                "attention_mask": {0: "batch", 1: "tokens"},
+                "encoder_hidden_states": {0: "batch"},
+                "last_hidden_state": {0: "batch", 1: "tokens"},
+                "attentions": {1: "batch", 3: "tokens", 4: "tokens"},
+                "cross_attentions": {1: "batch", 3: "tokens"},
+            },
+            opset_version=17,
+        )
+
+
+def _session(path, num_threads=None):
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if num_threads:
+        options.intra_op_num_threads = num_threads
+    return ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+
+# Drop-in replacement for model.vision_model
+class OnnxVisionModel:
+    def __init__(self, session):
+        self.session = session
+
+    def __call__(self, pixel_values, **kwargs):
+        (embeds,) = self.session.run(None, {"pixel_values": pixel_values.numpy()})
+        return (torch.from_numpy(embeds),)
+
+
+# Drop-in replacement for model.text_encoder as called by generate_from_embeds
+class OnnxTextEncoder:
+    def __init__(self, session):
+        self.session = session
+
+    def __call__(self, input_ids, attention_mask, encoder_hidden_states, output_attentions=False, **kwargs):
+        hidden, attentions, cross_attentions = self.session.run(None, {
+            "input_ids": input_ids.numpy(),
+            "attention_mask": attention_mask.numpy(),
+            "encoder_hidden_states": encoder_hidden_states.numpy(),
+        })
+        outputs = SimpleNamespace(last_hidden_state=torch.from_numpy(hidden), attentions=None, cross_attentions=None)
+        if output_attentions:
+            outputs.attentions = tuple(torch.from_numpy(attentions))
+            outputs.cross_attentions = tuple(torch.from_numpy(cross_attentions))
+        return outputs
+
+
+# Swap the vision and text encoders for ONNX Runtime sessions, exporting them
+# on first use. The text decoder stays in PyTorch: VQA answers are a few tokens
+# and generate() drives it step by step, so the encoders dominate the latency.
+def attach_onnx(model, onnx_dir=DEFAULT_ONNX_DIR, num_threads=None):
+    vision_path = os.path.join(onnx_dir, "vision_encoder.onnx")
+    text_path = os.path.join(onnx_dir, "text_encoder.onnx")
+    if not (os.path.exists(vision_path) and os.path.exists(text_path)):
+        export_onnx(model, onnx_dir)
+
+    # Plain attribute assignment: these replace registered torch submodules
+    model._modules.pop("vision_model")
+    model._modules.pop("text_encoder")
+    model.vision_model = OnnxVisionModel(_session(vision_path, num_threads))
+    model.text_encoder = OnnxTextEncoder(_session(text_path, num_threads))
+    return model
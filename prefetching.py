@@ -0,0 +1,29 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Runs load(record) on a thread pool, keeping at most `window` loads in
+# flight, and yields (record, result) in input order. Shared by the offline
+# evaluation CLI and the bulk upload grid.
+def prefetch(records, load, workers=4, window=32):
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="vqa-decode") as pool:
+        pending = deque()
+        for record in records:
+            pending.append((record, pool.submit(load, record)))
+            if len(pending) >= window:
+                record, future = pending.popleft()
+                yield record, future.result()
+        while pending:
+            record, future = pending.popleft()
+            yield record, future.result()
+
+
+def batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,71 @@
+import time
+from collections import namedtuple
+
+from PIL import Image, ImageOps
+
+import metrics
+
+# BLIP's image processor resizes to a fixed square; handing it an image that is
+# already this size makes its own resize a no-op
+MODEL_SIZE = 384
+
+# Longest side of the image shown in the UI and used for heatmap overlays
+DISPLAY_SIZE = 768
+
+# Refuse uploads above this many pixels before decoding them (~50 MP)
+MAX_PIXELS = 50_000_000
+
+PreprocessedImage = namedtuple("PreprocessedImage", ["model_image", "display_image", "original_size", "timings"])
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+def _to_rgb(image):
+    if image.mode == "RGB":
+        return image
+    if image.mode == "P" and "transparency" in image.info:
+        image = image.convert("RGBA")
+    if image.mode in ("RGBA", "LA"):
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+
+# Open an upload (path, file object or Streamlit UploadedFile) and produce a
+# model-resolution image plus a display thumbnail. JPEGs are decoded at a
+# reduced scale via Image.draft, EXIF orientation is applied, and the colour
+# mode is converted once.
+def preprocess_upload(source, model_size=MODEL_SIZE, display_size=DISPLAY_SIZE, max_pixels=MAX_PIXELS):
+    timings = {}
+    started = time.perf_counter()
+
+    image = Image.open(source)
+    original_size = image.size
+    if original_size[0] * original_size[1] > max_pixels:
+        raise ImageTooLarge(f"Image is {original_size[0]}x{original_size[1]}, limit is {max_pixels} pixels")
+    timings["open"] = time.perf_counter() - started
+
+    step = time.perf_counter()
+    target = max(model_size, display_size)
+    image.draft("RGB", (target, target))
+    image.load()
+    timings["decode"] = time.perf_counter() - step
+
+    step = time.perf_counter()
+    ImageOps.exif_transpose(image, in_place=True)
+    image = _to_rgb(image)
+    timings["convert"] = time.perf_counter() - step
+
+    step = time.perf_counter()
+    display_image = image.copy()
+    display_image.thumbnail((display_size, display_size), Image.BICUBIC, reducing_gap=2.0)
+    model_image = image.resize((model_size, model_size), Image.BICUBIC, reducing_gap=2.0)
+    timings["resize"] = time.perf_counter() - step
+
+    timings["total"] = time.perf_counter() - started
+    for stage, seconds in timings.items():
+        metrics.observe("vqa_stage_seconds", seconds, stage=f"upload_{stage}")
+    return PreprocessedImage(model_image, display_image, original_size, timings)
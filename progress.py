@@ -0,0 +1,53 @@
+import time
+from contextlib import contextmanager
+
+# Stages of one VQA request, in order
+STAGES = ("preprocess", "encode", "decode", "explain")
+
+
+# Reports stage start/finish and streamed tokens to any number of listeners.
+# A listener is a callable taking one event dict:
+#   {"type": "stage_started", "stage": name}
+#   {"type": "stage_finished", "stage": name, "seconds": float, "completed": int, "total": int}
+#   {"type": "token", "stage": name, "text": str}
+class StageReporter:
+    def __init__(self, stages=STAGES, listeners=None):
+        self.stages = tuple(stages)
+        self.listeners = list(listeners or [])
+        self.timings = {}
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+        return listener
+
+    def emit(self, event):
+        for listener in self.listeners:
+            listener(event)
+
+    @contextmanager
+    def stage(self, name):
+        self.emit({"type": "stage_started", "stage": name})
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    # For stages that were timed elsewhere (e.g. preprocessing at upload time)
+    def record(self, name, seconds):
+        self.timings[name] = seconds
+        self.emit({
+            "type": "stage_finished",
+            "stage": name,
+            "seconds": seconds,
+            "completed": len(self.timings),
+            "total": len(self.stages),
+        })
+
+    # Wrap a token iterator as a stage: each token is reported as it passes
+    # through, and the stage finishes when the iterator is exhausted
+    def stream(self, name, tokens):
+        with self.stage(name):
+            for token in tokens:
+                self.emit({"type": "token", "stage": name, "text": token})
+                yield token
@@ -0,0 +1,85 @@
+import re
+
+import numpy as np
+
+# Question categories in priority order, with keyword patterns matched on
+# token boundaries. The first category (in this order) with a match wins.
+CATEGORY_KEYWORDS = [
+    ("color", [r"colou?rs?"]),
+    ("people", [r"people", r"persons?", r"many"]),
+    ("object", [r"objects?", r"things?", r"main", r"what is"]),
+    ("location", [r"where", r"locations?", r"places?", r"setting"]),
+    ("activity", [r"doing", r"activity", r"activities", r"actions?", r"happening"]),
+]
+
+CATEGORIES = [category for category, _ in CATEGORY_KEYWORDS]
+
+# Suggested questions shown in the UIs (also the benchmark question mix)
+QUICK_QUESTIONS = [
+    "What is the main object?",
+    "How many people are there?",
+    "What colors do you see?",
+    "What is the setting?"
+]
+
+SAMPLE_QUESTIONS = [
+    "What is the main object in this image?",
+    "What color is the dominant object?",
+    "How many people are visible?",
+    "What is the setting or location?",
+    "What activity is taking place?",
+    "What time of day does this appear to be?"
+]
+
+
+# Keyword -> category router compiled once into a single regex. Each category
+# is a named group, so one scan finds every category a question mentions.
+class QuestionRouter:
+    def __init__(self, category_keywords=CATEGORY_KEYWORDS):
+        self.categories = [category for category, _ in category_keywords]
+        self._rank = {category: rank for rank, category in enumerate(self.categories)}
+        alternation = "|".join(
+            f"(?P<{category}>\\b(?:{'|'.join(keywords)})\\b)" for category, keywords in category_keywords
+        )
+        self.pattern = re.compile(alternation, re.IGNORECASE)
+
+    # Category for one question, or None when no keyword matches
+    def classify(self, question):
+        best = len(self.categories)
+        for match in self.pattern.finditer(question):
+            best = min(best, self._rank[match.lastgroup])
+            if best == 0:
+                break
+        return self.categories[best] if best < len(self.categories) else None
+
+    # Batch version: scans all questions as one newline-joined string and maps
+    # matches back to their question with a searchsorted over the offsets
+    def classify_many(self, questions):
+        if not questions:
+            return []
+        cleaned = [question.replace("\n", " ") for question in questions]
+        offsets = np.cumsum([0] + [len(question) + 1 for question in cleaned[:-1]])
+        text = "\n".join(cleaned)
+
+        starts = []
+        ranks = []
+        for match in self.pattern.finditer(text):
+            starts.append(match.start())
+            ranks.append(self._rank[match.lastgroup])
+
+        best = np.full(len(questions), len(self.categories))
+        if starts:
+            owners = np.searchsorted(offsets, starts, side="right") - 1
+            np.minimum.at(best, owners, ranks)
+        return [self.categories[rank] if rank < len(self.categories) else None for rank in best]
+
+
+ROUTER = QuestionRouter()
+
+
+def classify(question):
+    return ROUTER.classify(question)
+
+
+def classify_many(questions):
+    return ROUTER.classify_many(questions)
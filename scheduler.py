@@ -0,0 +1,275 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+import metrics
+
+# Priority classes, served strictly in this order: a batch request only runs
+# when no interactive request is waiting
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITIES = (INTERACTIVE, BATCH)
+
+# Requests waiting at once; past this new requests are refused (QueueFull)
+QUEUE_DEPTH = int(os.environ.get("VQA_QUEUE_DEPTH", "256"))
+
+# Share of the queue batch requests may fill, keeping room for interactive ones
+BATCH_SHARE = 0.75
+
+# Seconds a request may wait for its answer before it is given up. With
+# VQA_WORKERS the worker pool applies QUEUE_DEPTH and BATCH_SHARE too, but
+# each worker serves its queue first come first served: no per-session turns
+# and no priority ordering, and expired requests are only given up by the
+# waiting caller, not dropped from the worker's queue.
+DEADLINES = {INTERACTIVE: 30.0, BATCH: 300.0}
+
+# How often waiters report queue position and check for cancellation
+POLL_SECONDS = 0.25
+
+# Weight of the newest batch in the moving average of seconds per request
+_SMOOTHING = 0.2
+
+
+class QueueFull(RuntimeError):
+    pass
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+def deadline_for(priority, now=None):
+    return (now if now is not None else time.monotonic()) + DEADLINES[priority]
+
+
+class _Entry:
+    __slots__ = ("item", "future", "session", "priority", "deadline", "enqueued")
+
+    def __init__(self, item, future, session, priority, deadline):
+        self.item = item
+        self.future = future
+        self.session = session
+        self.priority = priority
+        self.deadline = deadline
+        self.enqueued = time.monotonic()
+
+
+# Bounded request queue in front of the model. Within a priority class every
+# session has its own FIFO and sessions take turns (round robin), so one
+# session submitting a hundred images does not hold up another's single
+# question. Requests past their deadline, or whose future was cancelled, are
+# dropped instead of run. get() is the consumer side (see MicroBatcher).
+class RequestScheduler:
+    def __init__(self, max_depth=QUEUE_DEPTH, batch_share=BATCH_SHARE):
+        self.max_depth = max_depth
+        self.batch_share = batch_share
+        self.rejected = 0
+        self.expired = 0
+        self.cancelled = 0
+        # priority -> session -> deque of entries, sessions in serving order
+        self._classes = {priority: OrderedDict() for priority in PRIORITIES}
+        self._entries = {}
+        self._request_seconds = None
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def _limit(self, priority):
+        return self.max_depth if priority == INTERACTIVE else int(self.max_depth * self.batch_share)
+
+    # Drops expired and cancelled entries (run when the queue looks full)
+    def _purge(self, now):
+        for priority, sessions in self._classes.items():
+            for session in list(sessions):
+                entries = sessions[session]
+                kept = deque(entry for entry in entries if not self._dropped(entry, now))
+                if kept:
+                    sessions[session] = kept
+                else:
+                    del sessions[session]
+
+    # True (and the entry is forgotten) when it should not run
+    def _dropped(self, entry, now):
+        if entry.future.cancelled():
+            self.cancelled += 1
+            metrics.inc("vqa_queue_dropped_total", reason="cancelled", priority=entry.priority)
+        elif entry.deadline is not None and now > entry.deadline:
+            self.expired += 1
+            metrics.inc("vqa_queue_dropped_total", reason="deadline", priority=entry.priority)
+            # Unless the owner cancelled it in the meantime
+            if entry.future.set_running_or_notify_cancel():
+                entry.future.set_exception(DeadlineExceeded(f"Waited {now - entry.enqueued:.1f}s in the queue"))
+        else:
+            return False
+        del self._entries[entry.future]
+        return True
+
+    # Queues (item, future) pairs for one session, all or none. Raises
+    # QueueFull when they do not fit.
+    def put_many(self, pairs, session=None, priority=INTERACTIVE, deadline=None):
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority {priority!r}, expected one of {PRIORITIES}")
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Scheduler is closed")
+            if len(self._entries) + len(pairs) > self._limit(priority):
+                self._purge(time.monotonic())
+            if len(self._entries) + len(pairs) > self._limit(priority):
+                self.rejected += len(pairs)
+                metrics.inc("vqa_queue_rejected_total", len(pairs), priority=priority)
+                raise QueueFull(f"No room in the VQA queue for {len(pairs)} more ({len(self._entries)} waiting)")
+            sessions = self._classes[priority]
+            entries = sessions.get(session)
+            if entries is None:
+                entries = sessions[session] = deque()
+            for item, future in pairs:
+                entry = _Entry(item, future, session, priority, deadline)
+                entries.append(entry)
+                self._entries[future] = entry
+            self._cond.notify(len(pairs))
+
+    def put(self, item, future, session=None, priority=INTERACTIVE, deadline=None):
+        self.put_many([(item, future)], session, priority, deadline)
+
+    # Next (item, future) to run, or None after timeout seconds, or once the
+    # scheduler is closed and drained
+    def get(self, timeout=None):
+        end = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                for priority in PRIORITIES:
+                    sessions = self._classes[priority]
+                    while sessions:
+                        session, entries = next(iter(sessions.items()))
+                        entry = entries.popleft()
+                        if entries:
+                            sessions.move_to_end(session)
+                        else:
+                            del sessions[session]
+                        if self._dropped(entry, now):
+                            continue
+                        del self._entries[entry.future]
+                        metrics.observe("vqa_queue_wait_seconds", now - entry.enqueued, priority=priority)
+                        return entry.item, entry.future
+                if self._closed:
+                    return None
+                remaining = None if end is None else end - now
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+    def qsize(self):
+        with self._cond:
+            return len(self._entries)
+
+    # Requests that will run before this one (ignoring later arrivals), or
+    # None once it has left the queue
+    def position(self, future):
+        with self._cond:
+            entry = self._entries.get(future)
+            if entry is None:
+                return None
+            ahead = 0
+            for priority in PRIORITIES:
+                sessions = self._classes[priority]
+                if priority != entry.priority:
+                    ahead += sum(len(entries) for entries in sessions.values())
+                    continue
+                # Sessions ahead of ours in the rotation get one more turn
+                index = sessions[entry.session].index(entry)
+                before = True
+                for session, entries in sessions.items():
+                    if session == entry.session:
+                        before = False
+                        ahead += index
+                    else:
+                        ahead += min(len(entries), index + 1 if before else index)
+                break
+            return ahead
+
+    # (position, estimated seconds until answered) of the first future still
+    # queued, or (None, None) when none is
+    def status(self, futures):
+        for future in futures:
+            position = self.position(future)
+            if position is not None:
+                with self._cond:
+                    per_request = self._request_seconds
+                return position, (position + 1) * per_request if per_request else None
+        return None, None
+
+    # Feeds the time a batch of `requests` took into the ETA estimate
+    def record(self, seconds, requests):
+        per_request = seconds / max(requests, 1)
+        with self._cond:
+            if self._request_seconds is None:
+                self._request_seconds = per_request
+            else:
+                self._request_seconds += _SMOOTHING * (per_request - self._request_seconds)
+
+    # Cancels everything a session still has queued (e.g. it disconnected)
+    def cancel_session(self, session):
+        with self._cond:
+            futures = [
+                entry.future
+                for sessions in self._classes.values()
+                for entry in sessions.get(session, ())
+            ]
+        return sum(future.cancel() for future in futures)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def gauges(self):
+        with self._cond:
+            return {
+                ("vqa_queue_depth", (("priority", priority),)): sum(len(entries) for entries in sessions.values())
+                for priority, sessions in self._classes.items()
+            }
+
+
+# Blocks until every future in ready is done. While waiting, on_wait is
+# called every poll seconds with the (position, eta) of the queued futures.
+# If the deadline passes, or anything raises while waiting (including
+# on_wait), the queued futures are cancelled.
+def wait_for(scheduler, queued, ready, deadline=None, on_wait=None, poll=POLL_SECONDS):
+    try:
+        pending = [future for future in ready if not future.done()]
+        while pending:
+            for future in queued:
+                # A request dropped from the queue will never make ready done
+                if future.done() and (future.cancelled() or future.exception() is not None):
+                    future.result()
+            timeout = poll
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise DeadlineExceeded("No answer before the deadline")
+                timeout = min(timeout, remaining)
+            if on_wait is not None and scheduler is not None:
+                position, eta = scheduler.status(queued)
+                if position is not None:
+                    on_wait(position, eta)
+            wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            pending = [future for future in pending if not future.done()]
+    except BaseException:
+        for future in queued:
+            future.cancel()
+        raise
+
+
+# Streamlit glue: an on_wait callback showing queue position and ETA in a
+# placeholder. Writing to the page is also where Streamlit stops a script
+# run, so a user who reruns or leaves cancels their queued requests.
+def queue_indicator(placeholder):
+    def on_wait(position, eta):
+        text = f"⏳ {position} request{'s' if position != 1 else ''} ahead of yours"
+        if eta is not None:
+            text += f" · about {eta:.0f}s"
+        placeholder.caption(text)
+
+    return on_wait
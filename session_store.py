@@ -0,0 +1,224 @@
+import hashlib
+import threading
+import time
+from collections import Counter, OrderedDict, namedtuple
+
+import metrics
+from caching import image_key
+from preprocessing import preprocess_upload
+
+# Byte budget for decoded images across every session in the process
+IMAGE_STORE_MB = 512
+
+# Sessions not seen for this long lose their images
+SESSION_IDLE_SECONDS = 30 * 60
+
+StoredImage = namedtuple("StoredImage", ["prepared", "image_hash", "nbytes"])
+
+
+# Content address for raw upload bytes
+def upload_key(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _image_bytes(image):
+    return image.width * image.height * len(image.getbands())
+
+
+# Decoded uploads shared by every Streamlit session in the process. Each
+# distinct upload (by content) is stored once; sessions only hold its key.
+# Entries no session references go first when the byte budget is exceeded,
+# then the least recently used referenced ones: a session whose image was
+# evicted simply preprocesses its upload again. Sessions that end, or stay
+# idle past idle_seconds, drop their references.
+class SessionImageStore:
+    def __init__(self, max_bytes=IMAGE_STORE_MB * 1024 * 1024, idle_seconds=SESSION_IDLE_SECONDS):
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        # session id -> {"keys": set of entry keys, "last_seen": monotonic time}
+        self._sessions = {}
+        # entry key -> number of sessions holding it
+        self._refs = Counter()
+        self._lock = threading.Lock()
+
+    def _session(self, session_id):
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._sessions[session_id] = {"keys": set(), "last_seen": 0.0}
+        session["last_seen"] = time.monotonic()
+        return session
+
+    def _hold(self, session, key):
+        if key not in session["keys"]:
+            session["keys"].add(key)
+            self._refs[key] += 1
+
+    def _drop(self, session, keys):
+        for key in list(keys):
+            session["keys"].discard(key)
+            self._refs[key] -= 1
+            if self._refs[key] <= 0:
+                del self._refs[key]
+
+    def _evict(self, key):
+        entry = self._entries.pop(key)
+        self.current_bytes -= entry.nbytes
+        self.evictions += 1
+
+    def _shrink(self):
+        for key in [key for key in self._entries if key not in self._refs]:
+            if self.current_bytes <= self.max_bytes:
+                return
+            self._evict(key)
+        while self.current_bytes > self.max_bytes and self._entries:
+            self._evict(next(iter(self._entries)))
+
+    def get(self, session_id, key):
+        with self._lock:
+            session = self._session(session_id)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            self._hold(session, key)
+            return entry
+
+    def put(self, session_id, key, prepared):
+        nbytes = _image_bytes(prepared.model_image) + _image_bytes(prepared.display_image)
+        entry = StoredImage(prepared, image_key(prepared.model_image), nbytes)
+        with self._lock:
+            session = self._session(session_id)
+            self._hold(session, key)
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self._entries[key] = entry
+            self.current_bytes += nbytes
+            self._shrink()
+            return entry
+
+    # Drops the session's reference to key (or to all its images)
+    def release(self, session_id, key=None):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return
+            if key is None:
+                self._drop(session, session["keys"])
+            elif key in session["keys"]:
+                self._drop(session, [key])
+            self._shrink()
+
+    def end_session(self, session_id):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is not None:
+                self._drop(session, session["keys"])
+            self._shrink()
+
+    # Ends sessions idle for too long, or that is_active reports gone
+    def sweep(self, is_active=None):
+        now = time.monotonic()
+        with self._lock:
+            expired = [
+                session_id
+                for session_id, session in self._sessions.items()
+                if now - session["last_seen"] > self.idle_seconds or (is_active and not is_active(session_id))
+            ]
+            for session_id in expired:
+                session = self._sessions.pop(session_id)
+                self._drop(session, session["keys"])
+            # Unreferenced images are only kept while there is room
+            self._shrink()
+        return expired
+
+    def session_stats(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id, {"keys": set()})
+            keys = [key for key in session["keys"] if key in self._entries]
+            return {"images": len(keys), "bytes": sum(self._entries[key].nbytes for key in keys)}
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "sessions": len(self._sessions),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def gauges(self):
+        stats = self.stats()
+        return {
+            ("vqa_image_store_bytes", ()): stats["bytes"],
+            ("vqa_image_store_entries", ()): stats["entries"],
+            ("vqa_image_store_sessions", ()): stats["sessions"],
+        }
+
+    # Decoded image for a Streamlit upload, preprocessing it only when no
+    # session has it stored. The session's previous upload is released.
+    def prepare_upload(self, session_id, uploaded_file, previous_key=None):
+        key = upload_key(uploaded_file.getvalue())
+        if previous_key is not None and previous_key != key:
+            self.release(session_id, previous_key)
+        entry = self.get(session_id, key)
+        if entry is None:
+            entry = self.put(session_id, key, preprocess_upload(uploaded_file))
+        return key, entry
+
+
+def create_store(**options):
+    store = SessionImageStore(**options)
+    metrics.REGISTRY.register_collector(store.gauges)
+    return store
+
+
+# Streamlit session id of the running script, and whether a session is still
+# connected (both None/True outside a Streamlit server)
+def current_session_id():
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+    except ImportError:
+        return None
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else None
+
+
+def session_is_active(session_id):
+    try:
+        from streamlit import runtime
+
+        return runtime.get_instance().is_active_session(session_id)
+    except Exception:
+        return True
+
+
+# Streamlit glue: the current session's stored upload, or None without one.
+# The key lives in st.session_state, so replacing or removing the upload
+# releases the old image; every call also sweeps idle and closed sessions.
+def session_upload(store, uploaded_file, state_key="image_store_key"):
+    import streamlit as st
+
+    session_id = current_session_id()
+    store.sweep(session_is_active)
+    previous = st.session_state.get(state_key)
+    if uploaded_file is None:
+        if previous is not None:
+            store.release(session_id, previous)
+            del st.session_state[state_key]
+        return None
+    key, entry = store.prepare_upload(session_id, uploaded_file, previous)
+    st.session_state[state_key] = key
+    return entry
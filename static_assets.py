@@ -0,0 +1,91 @@
+import hashlib
+import os
+from collections import namedtuple
+
+import metrics
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+ASSETS_DIR = os.path.join(ROOT, "assets")
+
+# Streamlit serves <app dir>/static/ at app/static/ when
+# server.enableStaticServing is on (see .streamlit/config.toml)
+STATIC_DIR = os.path.join(ROOT, "static")
+STATIC_URL = "app/static"
+
+# Low-cost rendering: no infinite gradient, shimmer, pulse or other animation
+REDUCED_MOTION_CSS = (
+    ".stApp, .stApp *, .stApp *::before, .stApp *::after "
+    "{ animation: none !important; transition: none !important; } "
+    ".stApp { background-size: 100% 100% !important; }"
+)
+
+StaticAsset = namedtuple("StaticAsset", ["name", "digest", "url", "css"])
+
+_published = {}
+
+
+# Copies assets/<name> to static/<stem>.<content hash><ext> once per process.
+# The hashed name never changes content, so browsers may cache it forever.
+def publish(name):
+    asset = _published.get(name)
+    if asset is not None:
+        return asset
+
+    with open(os.path.join(ASSETS_DIR, name), "rb") as f:
+        data = f.read()
+    digest = hashlib.blake2b(data, digest_size=8).hexdigest()
+    stem, ext = os.path.splitext(name)
+    filename = f"{stem}.{digest}{ext}"
+    path = os.path.join(STATIC_DIR, filename)
+    if not os.path.exists(path):
+        os.makedirs(STATIC_DIR, exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+
+    asset = _published[name] = StaticAsset(name, digest, f"{STATIC_URL}/{filename}?v={digest}", data.decode())
+    return asset
+
+
+def _link_script(asset):
+    element_id = f"vqa-css-{os.path.splitext(asset.name)[0]}"
+    return f"""<script>
+const doc = window.parent.document;
+let link = doc.getElementById("{element_id}");
+if (!link) {{
+    link = doc.createElement("link");
+    link.id = "{element_id}";
+    link.rel = "stylesheet";
+    doc.head.appendChild(link);
+}}
+link.href = new URL("{asset.url}", window.parent.location.href).href;
+</script>"""
+
+
+def _send(st, body):
+    metrics.inc("vqa_ui_css_bytes_total", len(body.encode()))
+    st.markdown(body, unsafe_allow_html=True)
+
+
+# Adds assets/<name> to the page. With static serving on, a <link> to the
+# hashed file is put in the page <head> once per session (it outlives the
+# reruns that would otherwise re-send the whole stylesheet); without it the
+# CSS is inlined on every rerun as before. reduced_motion adds a few bytes of
+# CSS that stop every animation.
+def inject_css(name, reduced_motion=False):
+    import streamlit as st
+
+    asset = publish(name)
+    metrics.inc("vqa_ui_reruns_total")
+    if not st.get_option("server.enableStaticServing"):
+        _send(st, f"<style>{asset.css}</style>")
+    elif st.session_state.get(f"css_{name}") != asset.digest:
+        import streamlit.components.v1 as components
+
+        script = _link_script(asset)
+        metrics.inc("vqa_ui_css_bytes_total", len(script.encode()))
+        components.html(script, height=0)
+        st.session_state[f"css_{name}"] = asset.digest
+
+    if reduced_motion:
+        _send(st, f"<style>{REDUCED_MOTION_CSS}</style>")
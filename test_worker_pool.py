@@ -0,0 +1,49 @@
+import time
+
+import pytest
+from PIL import Image
+
+from backends import MockBackend
+from scheduler import QueueFull
+from worker_pool import WorkerPool
+
+
+# Mock answers that take long enough to cancel a request while it is queued
+class SlowBackend(MockBackend):
+    def answer_batch(self, images, questions, image_hashes=None):
+        time.sleep(0.3)
+        return super().answer_batch(images, questions, image_hashes)
+
+
+@pytest.fixture
+def pool():
+    pool = WorkerPool(SlowBackend(seed=0), workers=2, pin_cpus=False, max_depth=4)
+    pool.load()
+    yield pool
+    pool.close()
+
+
+# A request cancelled while a worker holds it (deadline, rerun) must not take
+# the result reader down with it when its answer arrives
+def test_cancelled_request_keeps_pool_serving(pool):
+    image = Image.new("RGB", (32, 32), (200, 30, 30))
+    cancelled = pool.submit((image, "what color is it?", None))
+    assert cancelled.cancel()
+
+    answered = pool.submit((Image.new("RGB", (32, 32)), "how many people?", None))
+    assert answered.result(timeout=10)["answer"]
+    deadline = time.monotonic() + 5
+    while pool.outstanding() != [0, 0] and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    assert pool._reader.is_alive()
+    assert pool.outstanding() == [0, 0]
+    assert not pool._block_refs
+
+
+def test_full_pool_refuses_and_releases_images(pool):
+    images = [Image.new("RGB", (32, 32), (i, i, i)) for i in range(5)]
+    with pytest.raises(QueueFull):
+        pool.submit_many([(image, "what color is it?", None) for image in images])
+    assert pool.outstanding() == [0, 0]
+    assert not pool._block_refs
@@ -0,0 +1,307 @@
+import os
+import threading
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+from transformers import BlipProcessor, BlipForQuestionAnswering, TextIteratorStreamer
+
+import metrics
+from caching import image_key
+from generation import fixed_settings
+from explain import cross_attention_rollout, patch_grids
+import model_store
+
+MODEL_NAME = "Salesforce/blip-vqa-base"
+
+# Local model store (see model_store.py) to load from instead of the Hugging
+# Face hub/cache; needs no network access
+MODEL_DIR = os.environ.get("VQA_MODEL_DIR")
+
+# fp32: plain PyTorch; int8: dynamically quantized nn.Linear layers;
+# onnx: vision and text encoders on ONNX Runtime, decoder in PyTorch
+BACKENDS = ("fp32", "int8", "onnx")
+
+
+# Load the BLIP processor and model (uncached, callers decide how to cache),
+# memory-mapped from model_dir when one is given
+def load_vqa_model(model_name=MODEL_NAME, backend="fp32", onnx_dir=None, model_dir=MODEL_DIR):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend!r}, expected one of {BACKENDS}")
+
+    if model_dir:
+        processor, model = model_store.load(model_dir)
+    else:
+        processor = BlipProcessor.from_pretrained(model_name)
+        model = BlipForQuestionAnswering.from_pretrained(model_name)
+    model.eval()
+
+    if backend == "int8":
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    elif backend == "onnx":
+        import onnx_backend
+
+        model = onnx_backend.attach_onnx(model, onnx_dir or onnx_backend.DEFAULT_ONNX_DIR)
+    return processor, model
+
+
+# Run the BLIP vision encoder once per distinct image, reusing cached outputs.
+# When every row is the same image (many questions about one picture) the
+# single embedding is broadcast with expand() instead of copied per row.
+# image_hashes may be partial: images without one are hashed here.
+def encode_images(images, processor, model, embedding_cache=None, image_hashes=None):
+    if embedding_cache is not None:
+        hashes = image_hashes or [None] * len(images)
+        keys = [image_hash or image_key(image) for image_hash, image in zip(hashes, images)]
+    else:
+        keys = [id(image) for image in images]
+
+    embeds = {}
+    missing = {}
+    for key, image in zip(keys, images):
+        if key in embeds or key in missing:
+            continue
+        cached = embedding_cache.get(key) if embedding_cache is not None else None
+        if cached is not None:
+            embeds[key] = cached
+        else:
+            missing[key] = image
+
+    if missing:
+        with metrics.timer("vqa_stage_seconds", stage="image_processor"):
+            pixel_values = processor.image_processor(list(missing.values()), return_tensors="pt").pixel_values
+        with torch.no_grad(), metrics.timer("vqa_stage_seconds", stage="vision_encode"):
+            encoded = model.vision_model(pixel_values=pixel_values)[0]
+        for key, embed in zip(missing, encoded):
+            # Clone so a cached row does not pin the whole batch tensor
+            embed = embed.clone()
+            embeds[key] = embed
+            if embedding_cache is not None:
+                embedding_cache.put(key, embed)
+
+    if len(embeds) == 1:
+        return next(iter(embeds.values())).unsqueeze(0).expand(len(keys), -1, -1)
+    return torch.stack([embeds[key] for key in keys])
+
+
+# Text encoder + decoder half of BlipForQuestionAnswering.generate, starting
+# from precomputed image embeddings. Returns the generate output and the text
+# encoder output (which carries attentions when output_attentions is set).
+def generate_from_embeds(model, image_embeds, input_ids, attention_mask, output_attentions=False, **generate_kwargs):
+    image_attention_mask = torch.ones(image_embeds.shape[:-1], dtype=torch.long, device=image_embeds.device)
+
+    question_outputs = model.text_encoder(
+        input_ids=input_ids,
+        attention_mask=attention_mask,
+        encoder_hidden_states=image_embeds,
+        encoder_attention_mask=image_attention_mask,
+        output_attentions=output_attentions,
+        return_dict=True,
+    )
+    question_embeds = question_outputs.last_hidden_state
+
+    bos_ids = torch.full(
+        (question_embeds.size(0), 1), model.decoder_start_token_id, dtype=torch.long, device=question_embeds.device
+    )
+    outputs = model.text_decoder.generate(
+        input_ids=bos_ids,
+        eos_token_id=model.config.text_config.sep_token_id,
+        pad_token_id=model.config.text_config.pad_token_id,
+        encoder_hidden_states=question_embeds,
+        encoder_attention_mask=attention_mask,
+        **generate_kwargs,
+    )
+    return outputs, question_outputs
+
+
+# Patch-grid relevance maps from the text encoder attentions of the answering
+# pass: question tokens -> image patches, rolled out over the encoder layers
+def attention_heatmaps(question_outputs, attention_mask):
+    self_attentions = torch.stack(question_outputs.attentions).mean(dim=2).float().numpy()
+    cross_attentions = torch.stack(question_outputs.cross_attentions).mean(dim=2).float().numpy()
+    relevance = cross_attention_rollout(self_attentions, cross_attentions, attention_mask.numpy())
+    return patch_grids(relevance)
+
+
+# Mask of the generated tokens of each sequence up to and including its
+# first EOS (the rest is padding after the sequence finished)
+def answer_token_mask(model, generated):
+    is_eos = generated == model.config.text_config.sep_token_id
+    return (is_eos.long().cumsum(dim=1) - is_eos.long()) == 0
+
+
+# Length-normalized log-probability of each greedy sequence, counting tokens
+# up to and including the first EOS
+def sequence_log_probs(model, outputs):
+    token_log_probs = model.text_decoder.compute_transition_scores(
+        outputs.sequences, outputs.scores, normalize_logits=True
+    )
+    keep = answer_token_mask(model, outputs.sequences[:, -token_log_probs.shape[1]:])
+    token_log_probs = token_log_probs.masked_fill(~keep, 0.0)
+    return token_log_probs.sum(dim=1) / keep.sum(dim=1).clamp(min=1)
+
+
+# Map a mean token log-probability to a probability. temperature > 1 softens
+# over-confident scores, < 1 sharpens them; evaluate.py fits it on labelled
+# answers (see backends.CONFIDENCE_TEMPERATURE).
+def log_prob_to_confidence(log_probs, temperature=1.0):
+    return torch.exp(log_probs / temperature)
+
+
+# Answer many (image, question) pairs with a single padded generate call.
+# Confidence comes from the scores of that same call. generation (see
+# generation.py) picks greedy or beam search and the answer length cap; by
+# default top_k > 1 makes the call a beam search that also returns top_k - 1
+# alternative answers. With explain set, each result also carries a
+# patch-grid attention heatmap.
+def answer_batch(
+    images,
+    questions,
+    processor,
+    model,
+    embedding_cache=None,
+    image_hashes=None,
+    top_k=0,
+    temperature=1.0,
+    explain=False,
+    streamer=None,
+    generation=None,
+):
+    generation = generation or fixed_settings(top_k)
+    with metrics.timer("vqa_stage_seconds", stage="tokenize"):
+        text = processor.tokenizer(questions, padding=True, return_tensors="pt")
+    num_candidates = generation.num_return_sequences
+    generate_kwargs = {
+        "max_new_tokens": generation.max_new_tokens,
+        "output_scores": True,
+        "return_dict_in_generate": True,
+    }
+    if generation.num_beams > 1:
+        # early_stopping ends the search once num_beams answers reached EOS
+        generate_kwargs.update(
+            num_beams=generation.num_beams, num_return_sequences=num_candidates, early_stopping=True
+        )
+    if streamer is not None:
+        if len(questions) != 1 or generation.num_beams != 1:
+            raise ValueError("Streaming needs a single question and greedy decoding")
+        generate_kwargs["streamer"] = streamer
+
+    with torch.no_grad():
+        image_embeds = encode_images(images, processor, model, embedding_cache, image_hashes)
+        with metrics.timer("vqa_stage_seconds", stage="generate"):
+            outputs, question_outputs = generate_from_embeds(
+                model, image_embeds, text.input_ids, text.attention_mask, output_attentions=explain, **generate_kwargs
+            )
+        if generation.num_beams > 1:
+            log_probs = outputs.sequences_scores
+        else:
+            log_probs = sequence_log_probs(model, outputs)
+
+    # Tokens each answer took to reach EOS (the first token is the decoder start)
+    decode_steps = answer_token_mask(model, outputs.sequences[::num_candidates, 1:]).sum(dim=1).tolist()
+    for steps in decode_steps:
+        metrics.observe("vqa_decode_steps", steps, mode=generation.mode)
+
+    with metrics.timer("vqa_stage_seconds", stage="decode"):
+        texts = processor.batch_decode(outputs.sequences, skip_special_tokens=True)
+    confidences = log_prob_to_confidence(log_probs, temperature).tolist()
+    heatmaps = None
+    if explain:
+        with metrics.timer("vqa_stage_seconds", stage="explain"):
+            heatmaps = attention_heatmaps(question_outputs, text.attention_mask)
+
+    results = []
+    for i in range(len(questions)):
+        candidates = []
+        seen = set()
+        for j in range(i * num_candidates, (i + 1) * num_candidates):
+            if texts[j] in seen:
+                continue
+            seen.add(texts[j])
+            candidates.append({"answer": texts[j], "confidence": confidences[j]})
+        best = candidates[0]
+        result = {"answer": best["answer"], "confidence": best["confidence"], "alternatives": candidates[1:]}
+        if heatmaps is not None:
+            result["heatmap"] = np.round(heatmaps[i], 3).tolist()
+        if generation.downgraded:
+            result["downgraded"] = True
+        results.append(result)
+    return results
+
+
+# Streams answer text while generate() runs on a background thread. Iterate
+# it for text chunks; afterwards .result holds the same dict answer_batch
+# returns and .first_token_seconds the time to the first chunk. on_complete is
+# called with the result from the generating thread.
+class AnswerStream:
+    def __init__(
+        self,
+        image,
+        question,
+        processor,
+        model,
+        embedding_cache=None,
+        image_hash=None,
+        temperature=1.0,
+        explain=False,
+        on_complete=None,
+        generation=None,
+    ):
+        self.on_complete = on_complete
+        self.result = None
+        self.error = None
+        self.first_token_seconds = None
+        self._started = time.perf_counter()
+        self._streamer = TextIteratorStreamer(processor.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(image, question, processor, model, embedding_cache, image_hash, temperature, explain, generation),
+            name="vqa-stream",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def _run(self, image, question, processor, model, embedding_cache, image_hash, temperature, explain, generation):
+        try:
+            self.result = answer_batch(
+                [image],
+                [question],
+                processor,
+                model,
+                embedding_cache=embedding_cache,
+                image_hashes=[image_hash] if image_hash else None,
+                temperature=temperature,
+                explain=explain,
+                streamer=self._streamer,
+                generation=generation,
+            )[0]
+            if self.on_complete is not None:
+                self.on_complete(self.result)
+        except Exception as exc:
+            self.error = exc
+            # Unblock the consumer if generate() never got to end the stream
+            self._streamer.end()
+
+    # Blocks until generation has finished (without consuming the text)
+    def wait(self):
+        self._thread.join()
+
+    def __iter__(self):
+        for text in self._streamer:
+            if not text:
+                continue
+            if self.first_token_seconds is None:
+                self.first_token_seconds = time.perf_counter() - self._started
+            yield text
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+# One throwaway inference so the first real request does not pay one-time
+# allocation and kernel selection costs
+def warmup(processor, model):
+    image = Image.new("RGB", (384, 384), (127, 127, 127))
+    answer_batch([image], ["what is in the picture?"], processor, model, generation=fixed_settings(max_new_tokens=9))
+
@@ -0,0 +1,285 @@
+import os
+from concurrent.futures import Future
+
+import metrics
+from backends import CompletedStream, create_backend
+from batching import MicroBatcher
+from caching import AnswerCache, EmbeddingCache, answer_key, config_fingerprint, image_key
+from explain import HeatmapExplainer
+from generation import GENERATION_MODE
+from model_loader import ModelLoader
+from near_duplicates import ENABLED as NEAR_DUPLICATES, NearDuplicateIndex
+from scheduler import INTERACTIVE, deadline_for, wait_for
+from worker_pool import WorkerPool
+
+# Micro-batching settings for the shared inference engine
+MAX_BATCH_SIZE = 8
+MAX_WAIT_MS = 10
+
+# Model worker processes (0 runs the model in this process); threads per
+# worker default to an even split of the CPUs
+WORKERS = int(os.environ.get("VQA_WORKERS", "0"))
+THREADS_PER_WORKER = int(os.environ.get("VQA_THREADS_PER_WORKER", "0")) or None
+
+# Byte budget for cached BLIP vision encoder outputs
+EMBEDDING_CACHE_MB = 256
+
+# Answer memoization; set VQA_ANSWER_CACHE_PATH to persist answers in SQLite
+ANSWER_CACHE_SIZE = 4096
+ANSWER_CACHE_TTL = 3600
+ANSWER_CACHE_PATH = os.environ.get("VQA_ANSWER_CACHE_PATH")
+
+# Alternative answers returned alongside the best one (0 disables beam search)
+ANSWER_TOP_K = 3
+
+# Return attention heatmaps from the answering pass
+EXPLAIN = True
+
+# Run one throwaway inference after loading the model
+WARMUP = True
+
+# Model backend: blip, blip-int8, blip-onnx or mock (see backends.py)
+VQA_BACKEND = os.environ.get("VQA_BACKEND", "blip")
+
+# Hash used for requests that come without an image (mock backend only)
+NO_IMAGE = "no-image"
+
+
+# A streamed answer waiting for its turn on the batcher thread. started gets
+# the stream once it is running; the batcher thread then waits for the stream
+# to finish, so streams and batches never run the model at the same time.
+class _StreamJob:
+    def __init__(self, image, question, image_hash, on_complete):
+        self.image = image
+        self.question = question
+        self.image_hash = image_hash
+        self.on_complete = on_complete
+        self.started = Future()
+
+    # Errors reach the caller through started or the stream, not the batch
+    def run(self, backend):
+        if not self.started.set_running_or_notify_cancel():
+            return None
+        try:
+            stream = backend.stream(self.image, self.question, self.image_hash, on_complete=self.on_complete)
+        except Exception as exc:
+            self.started.set_exception(exc)
+            return None
+        self.started.set_result(stream)
+        stream.wait()
+        return stream.result
+
+
+# The VQA pipeline shared by the Streamlit UIs and the HTTP API: background
+# model loading, caches, and the micro-batching engine in front of a backend.
+# Requests carry a session (for round-robin fairness), a priority class and
+# an on_wait(position, eta) callback for queue-position displays; see
+# scheduler.py.
+class VQAService:
+    def __init__(
+        self,
+        backend=VQA_BACKEND,
+        warmup=WARMUP,
+        top_k=ANSWER_TOP_K,
+        explain=EXPLAIN,
+        max_batch_size=MAX_BATCH_SIZE,
+        max_wait_ms=MAX_WAIT_MS,
+        workers=WORKERS,
+        threads_per_worker=THREADS_PER_WORKER,
+        generation_mode=GENERATION_MODE,
+        near_duplicates=NEAR_DUPLICATES,
+    ):
+        self.embedding_cache = EmbeddingCache(max_bytes=EMBEDDING_CACHE_MB * 1024 * 1024)
+        self.answer_cache = AnswerCache(
+            max_entries=ANSWER_CACHE_SIZE, ttl_seconds=ANSWER_CACHE_TTL, path=ANSWER_CACHE_PATH
+        )
+        # Near-identical images share one image hash, and so their cached
+        # embeddings and answers
+        self.near_duplicates = NearDuplicateIndex() if near_duplicates else None
+        self.backend = create_backend(
+            backend,
+            top_k=top_k,
+            explain=explain,
+            embedding_cache=self.embedding_cache,
+            generation_mode=generation_mode,
+        )
+        # Answers are cached per backend configuration. Streamed answers are
+        # greedy with no alternatives, so they are kept apart from full ones.
+        self.answer_config = config_fingerprint(self.backend.cache_config())
+        self.stream_config = config_fingerprint({**self.backend.cache_config(), "streaming": True})
+        if workers:
+            # Workers batch their own queues, so the pool stands in for the batcher
+            self.backend = WorkerPool(self.backend, workers, threads_per_worker, batch_size=max_batch_size)
+            self.batcher = self.backend
+        else:
+            self.batcher = MicroBatcher(self._run_batch, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+            self.backend.set_queue_depth(self.batcher.pending)
+        # None in pool mode, where each worker serves its own queue in order
+        self.scheduler = self.batcher.scheduler
+        self.loader = ModelLoader(self.backend, warmup=warmup)
+        self.explainer = HeatmapExplainer()
+        metrics.REGISTRY.register_collector(self._cache_gauges)
+
+    def _cache_gauges(self):
+        embedding = self.embedding_cache.stats()
+        answers = self.answer_cache.stats()
+        return {
+            ("vqa_embedding_cache_entries", ()): embedding["entries"],
+            ("vqa_embedding_cache_bytes", ()): embedding["bytes"],
+            ("vqa_embedding_cache_hits", ()): embedding["hits"],
+            ("vqa_embedding_cache_misses", ()): embedding["misses"],
+            ("vqa_answer_cache_entries", ()): answers["entries"],
+            ("vqa_near_duplicate_index_entries", ()): len(self.near_duplicates or ()),
+            **(self.scheduler.gauges() if self.scheduler is not None else {}),
+        }
+
+    def start(self):
+        self.loader.start()
+        return self
+
+    def load_vqa_model(self):
+        return self.loader.wait()
+
+    def close(self):
+        self.batcher.close()
+        metrics.REGISTRY.unregister_collector(self._cache_gauges)
+
+    # Batcher items are (image, question, image_hash) tuples, or stream jobs
+    # which run one at a time after the rest of the batch
+    def _run_batch(self, items):
+        questions = [i for i, item in enumerate(items) if not isinstance(item, _StreamJob)]
+        results = [None] * len(items)
+        if questions:
+            answers = self.backend.answer_batch(
+                [items[i][0] for i in questions], [items[i][1] for i in questions], [items[i][2] for i in questions]
+            )
+            for i, answer in zip(questions, answers):
+                results[i] = answer
+        for i, item in enumerate(items):
+            if isinstance(item, _StreamJob):
+                results[i] = item.run(self.backend)
+        return results
+
+    # Queues items for the model and waits for their answers (raises
+    # scheduler.QueueFull or DeadlineExceeded)
+    def _submit(self, items, session, priority, on_wait):
+        deadline = deadline_for(priority)
+        futures = self.batcher.submit_many(items, session=session, priority=priority, deadline=deadline)
+        wait_for(self.scheduler, futures, futures, deadline, on_wait)
+        return [future.result() for future in futures]
+
+    def _hash(self, image, image_hash):
+        if image is None:
+            if image_hash:
+                return image_hash
+            if self.backend.needs_image:
+                raise ValueError(f"The {self.backend.name} backend needs an image")
+            return NO_IMAGE
+        image_hash = image_hash or image_key(image)
+        if self.near_duplicates is not None:
+            image_hash = self.near_duplicates.canonical(image, image_hash)
+        return image_hash
+
+    def _cached(self, key, path):
+        cached = self.answer_cache.get(key)
+        metrics.inc("vqa_answer_cache_total", result="hit" if cached is not None else "miss")
+        if cached is not None:
+            metrics.inc("vqa_requests_total", path=path, outcome="cached")
+        return cached
+
+    # Answers decoded with downgraded settings under load (see generation.py)
+    # are served but not cached, so they do not outlive the load
+    def _store(self, key, result):
+        if not result.get("downgraded"):
+            self.answer_cache.put(key, result)
+
+    # Returns a dict with answer, confidence, alternatives (and heatmap)
+    def answer_question(self, image, question, image_hash=None, session=None, priority=INTERACTIVE, on_wait=None):
+        with metrics.timer("vqa_request_seconds", path="answer"):
+            with metrics.timer("vqa_stage_seconds", stage="image_hash"):
+                image_hash = self._hash(image, image_hash)
+            key = answer_key(image_hash, question, self.answer_config)
+            cached = self._cached(key, "answer")
+            if cached is not None:
+                return cached
+
+            try:
+                self.load_vqa_model()
+                result = self._submit([(image, question, image_hash)], session, priority, on_wait)[0]
+            except Exception:
+                metrics.inc("vqa_requests_total", path="answer", outcome="error")
+                raise
+
+            metrics.inc("vqa_requests_total", path="answer", outcome="ok")
+            self._store(key, result)
+            return result
+
+    # Answers for (image, question, image_hash) items, in order. Uncached
+    # items go to the batcher together, so questions about the same image
+    # share one vision pass.
+    def answer_many(self, items, path="many", session=None, priority=INTERACTIVE, on_wait=None):
+        with metrics.timer("vqa_request_seconds", path=path):
+            items = [(image, question, self._hash(image, image_hash)) for image, question, image_hash in items]
+            keys = [answer_key(image_hash, question, self.answer_config) for _, question, image_hash in items]
+            results = [self._cached(key, path) for key in keys]
+            missing = [i for i, result in enumerate(results) if result is None]
+            if not missing:
+                return results
+
+            try:
+                self.load_vqa_model()
+                answers = self._submit([items[i] for i in missing], session, priority, on_wait)
+            except Exception:
+                metrics.inc("vqa_requests_total", len(missing), path=path, outcome="error")
+                raise
+
+            metrics.inc("vqa_requests_total", len(missing), path=path, outcome="ok")
+            for i, result in zip(missing, answers):
+                self._store(keys[i], result)
+                results[i] = result
+            return results
+
+    # Several questions about one image, sharing its vision pass
+    def answer_questions(self, image, questions, image_hash=None, session=None, priority=INTERACTIVE, on_wait=None):
+        image_hash = self._hash(image, image_hash)
+        return self.answer_many(
+            [(image, question, image_hash) for question in questions],
+            path="questions",
+            session=session,
+            priority=priority,
+            on_wait=on_wait,
+        )
+
+    # Like answer_question, but returns an iterable of answer text chunks as
+    # they are generated; .result holds the full dict once it is exhausted.
+    # Streams take their turn in the scheduler like any request, then run
+    # alone (streamers need a batch of one); this returns once it started.
+    def stream_question(self, image, question, image_hash=None, session=None, priority=INTERACTIVE, on_wait=None):
+        image_hash = self._hash(image, image_hash)
+        key = answer_key(image_hash, question, self.stream_config)
+        cached = self._cached(key, "stream")
+        if cached is not None:
+            return CompletedStream(cached)
+
+        def on_complete(result):
+            metrics.inc("vqa_requests_total", path="stream", outcome="ok")
+            self._store(key, result)
+
+        backend = self.load_vqa_model()
+        if self.scheduler is None:
+            return backend.stream(image, question, image_hash, on_complete=on_complete)
+
+        job = _StreamJob(image, question, image_hash, on_complete)
+        deadline = deadline_for(priority)
+        future = self.batcher.submit(job, session=session, priority=priority, deadline=deadline)
+        wait_for(self.scheduler, [future], [job.started], deadline, on_wait)
+        return job.started.result()
+
+    def heatmap_overlay(self, image, question, result, image_hash=None):
+        grid = self.backend.explain(image, question, result)
+        if grid is None or image is None:
+            return None
+        # The exact hash, not a near-duplicate's: the overlay is drawn on
+        # this image's own pixels
+        image_hash = image_hash or image_key(image)
+        return self.explainer.overlay(answer_key(image_hash, question, self.answer_config), image, grid)
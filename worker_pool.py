@@ -0,0 +1,383 @@
+import itertools
+import multiprocessing
+import os
+import pickle
+import queue
+import sys
+import threading
+from concurrent.futures import Future
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+from PIL import Image
+
+import metrics
+from backends import VQABackend
+from scheduler import BATCH, BATCH_SHARE, INTERACTIVE, QUEUE_DEPTH, QueueFull
+
+# Questions a worker pulls off its queue into one model batch
+WORKER_BATCH_SIZE = 8
+
+# How often the result reader checks for dead workers (seconds)
+HEALTH_INTERVAL = 1.0
+
+_STOP = "stop"
+_WARMUP = "warmup"
+
+
+def default_threads(workers):
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+# CPU sets for each worker when the platform lets us pin (Linux)
+def cpu_slices(workers):
+    if not hasattr(os, "sched_getaffinity"):
+        return [None] * workers
+    cpus = sorted(os.sched_getaffinity(0))
+    if len(cpus) < workers:
+        return [None] * workers
+    return [cpus[i::workers] for i in range(workers)]
+
+
+# Copies an image into a new shared memory block; workers attach by name
+def share_image(image):
+    if image is None:
+        return None, None
+    array = np.asarray(image if image.mode == "RGB" else image.convert("RGB"))
+    block = shared_memory.SharedMemory(create=True, size=array.nbytes)
+    try:
+        np.ndarray(array.shape, dtype=np.uint8, buffer=block.buf)[:] = array
+    except BaseException:
+        release_blocks([(block, array.shape)])
+        raise
+    return block, array.shape
+
+
+# Closes and unlinks (block, shape) pairs from share_image
+def release_blocks(blocks):
+    for block, _ in blocks:
+        if block is not None:
+            block.close()
+            block.unlink()
+
+
+def attach_image(name, shape):
+    if name is None:
+        return None
+    # The parent owns (and unlinks) the block. Before Python 3.13 attaching
+    # also registers it, which is harmless with the tracker shared (see load)
+    if sys.version_info >= (3, 13):
+        block = shared_memory.SharedMemory(name=name, track=False)
+    else:
+        block = shared_memory.SharedMemory(name=name)
+    try:
+        return Image.fromarray(np.ndarray(shape, dtype=np.uint8, buffer=block.buf).copy())
+    finally:
+        block.close()
+
+
+def _picklable(exc):
+    try:
+        pickle.dumps(exc)
+        return exc
+    except Exception:
+        return RuntimeError(f"{type(exc).__name__}: {exc}")
+
+
+# Requests still on a worker's queue (qsize is unsupported on macOS)
+def _queued(requests):
+    try:
+        return requests.qsize()
+    except NotImplementedError:
+        return 0
+
+
+def _set_threads(threads, cpus):
+    if cpus is not None:
+        os.sched_setaffinity(0, cpus)
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        torch.set_num_threads(threads)
+
+
+# Worker process: answers batches of (request_id, shm name, shape, question,
+# image_hash) messages from its own queue until it receives _STOP
+def _warmup(index, backend, results):
+    try:
+        backend.warmup()
+        results.put(("ready", index, None))
+    except Exception as exc:
+        results.put(("failed", index, _picklable(exc)))
+
+
+def _worker_main(index, backend, preloaded, threads, cpus, requests, results, batch_size):
+    try:
+        _set_threads(threads, cpus)
+        if not preloaded:
+            backend.import_modules()
+            backend.load()
+            _set_threads(threads, None)
+    except Exception as exc:
+        results.put(("failed", index, _picklable(exc)))
+        return
+    # The generation policy sees this worker's backlog only
+    backend.set_queue_depth(lambda: _queued(requests))
+
+    while True:
+        message = requests.get()
+        if message == _STOP:
+            return
+        if message == _WARMUP:
+            _warmup(index, backend, results)
+            continue
+
+        batch = [message]
+        control = None
+        while len(batch) < batch_size:
+            try:
+                message = requests.get_nowait()
+            except queue.Empty:
+                break
+            if message == _STOP or message == _WARMUP:
+                control = message
+                break
+            batch.append(message)
+
+        request_ids = [request_id for request_id, _, _, _, _ in batch]
+        try:
+            images = [attach_image(name, shape) for _, name, shape, _, _ in batch]
+            answers = backend.answer_batch(
+                images,
+                [question for _, _, _, question, _ in batch],
+                [image_hash for _, _, _, _, image_hash in batch],
+            )
+            results.put(("batch", index, (request_ids, answers)))
+        except Exception as exc:
+            results.put(("error", index, (request_ids, _picklable(exc))))
+        if control == _STOP:
+            return
+        if control == _WARMUP:
+            _warmup(index, backend, results)
+
+
+# Runs a backend in N worker processes. With the fork start method the parent
+# loads the model once and the workers inherit its weights copy-on-write;
+# otherwise each worker loads its own copy. Images travel through shared
+# memory, and each request goes to the worker with the fewest questions
+# outstanding. Workers batch whatever is queued for them, so the pool is used
+# in place of the in-process MicroBatcher (same submit()/close() interface).
+# Each worker has its own copy of the backend's embedding cache.
+class WorkerPool(VQABackend):
+    def __init__(
+        self,
+        backend,
+        workers,
+        threads_per_worker=None,
+        batch_size=WORKER_BATCH_SIZE,
+        pin_cpus=True,
+        max_depth=QUEUE_DEPTH,
+    ):
+        self.inner = backend
+        self.name = backend.name
+        self.needs_image = backend.needs_image
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker or default_threads(workers)
+        self.batch_size = batch_size
+        self.pin_cpus = pin_cpus
+        self.max_depth = max_depth
+        self.batches_run = 0
+        self.requests_run = 0
+
+        fork = "fork" in multiprocessing.get_all_start_methods()
+        self._context = multiprocessing.get_context("fork" if fork else None)
+        self._processes = []
+        self._requests = []
+        self._results = self._context.Queue()
+        self._outstanding = [0] * workers
+        self._pending = {}
+        # Shared memory block name -> [block, requests still using it]
+        self._block_refs = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._ready = threading.Semaphore(0)
+        self._failures = {}
+        self._reader = None
+        self.scheduler = None
+
+    def import_modules(self):
+        self.inner.import_modules()
+
+    # Loads weights in the parent (fork only), then starts the workers
+    def load(self):
+        preloaded = self._context.get_start_method() == "fork"
+        if preloaded:
+            self.inner.load()
+        # Workers must share our resource tracker, or each would start its own
+        # and unlink blocks it only attached to when it exits
+        resource_tracker.ensure_running()
+        cpus = cpu_slices(self.workers) if self.pin_cpus else [None] * self.workers
+        for index in range(self.workers):
+            requests = self._context.Queue()
+            process = self._context.Process(
+                target=_worker_main,
+                args=(index, self.inner, preloaded, self.threads_per_worker, cpus[index], requests, self._results,
+                      self.batch_size),
+                name=f"vqa-worker-{index}",
+                daemon=True,
+            )
+            process.start()
+            self._requests.append(requests)
+            self._processes.append(process)
+        self._reader = threading.Thread(target=self._read_results, name="vqa-pool-results", daemon=True)
+        self._reader.start()
+
+    # Each worker warms up its own copy (torch thread pools are per process)
+    def warmup(self):
+        for requests in self._requests:
+            requests.put(_WARMUP)
+        for _ in self._requests:
+            self._ready.acquire()
+        if self._failures:
+            raise next(iter(self._failures.values()))
+
+    # item is (image, question, image_hash), as for MicroBatcher
+    def submit(self, item, **scheduling):
+        return self.submit_many([item], **scheduling)[0]
+
+    # Questions about the same image go to the same (least loaded) worker,
+    # so they share its vision pass; each distinct image is copied into
+    # shared memory once. Like RequestScheduler, requests past max_depth
+    # outstanding (less for BATCH priority) are refused with QueueFull.
+    # Workers serve their queues in order, so session and priority do not
+    # reorder requests; deadlines are enforced by the waiting caller.
+    def submit_many(self, items, session=None, priority=INTERACTIVE, deadline=None):
+        futures = [Future() for _ in items]
+        groups = {}
+        for position, (image, _, _) in enumerate(items):
+            groups.setdefault(id(image), []).append(position)
+        blocks = {}
+        try:
+            for key, positions in groups.items():
+                blocks[key] = share_image(items[positions[0]][0])
+        except BaseException:
+            release_blocks(blocks.values())
+            raise
+
+        messages = []
+        with self._lock:
+            limit = int(self.max_depth * BATCH_SHARE) if priority == BATCH else self.max_depth
+            waiting = sum(self._outstanding)
+            full = waiting + len(items) > limit
+            live = [index for index in range(self.workers) if index not in self._failures]
+            for key, positions in groups.items() if live and not full else ():
+                index = min(live, key=self._outstanding.__getitem__)
+                self._outstanding[index] += len(positions)
+                block, shape = blocks[key]
+                if block is not None:
+                    self._block_refs[block.name] = [block, len(positions)]
+                for position in positions:
+                    request_id = next(self._ids)
+                    self._pending[request_id] = (futures[position], index, block)
+                    _, question, image_hash = items[position]
+                    messages.append((index, (request_id, block.name if block else None, shape, question, image_hash)))
+
+        if full:
+            release_blocks(blocks.values())
+            metrics.inc("vqa_queue_rejected_total", len(items), priority=priority)
+            raise QueueFull(f"No room in the VQA workers' queues for {len(items)} more ({waiting} waiting)")
+        if not live:
+            release_blocks(blocks.values())
+            for future in futures:
+                future.set_exception(RuntimeError("No live VQA workers"))
+            return futures
+
+        for index, message in messages:
+            self._requests[index].put(message)
+        return futures
+
+    def answer_batch(self, images, questions, image_hashes=None):
+        hashes = image_hashes or [None] * len(images)
+        futures = self.submit_many(list(zip(images, questions, hashes)))
+        return [future.result() for future in futures]
+
+    def explain(self, image, question, result):
+        return self.inner.explain(image, question, result)
+
+    def outstanding(self):
+        with self._lock:
+            return list(self._outstanding)
+
+    def _finish(self, request_id, result=None, error=None):
+        with self._lock:
+            future, index, block = self._pending.pop(request_id)
+            self._outstanding[index] -= 1
+            release = False
+            if block is not None:
+                refs = self._block_refs[block.name]
+                refs[1] -= 1
+                release = refs[1] == 0
+                if release:
+                    del self._block_refs[block.name]
+        if release:
+            block.close()
+            block.unlink()
+        # The caller may have given up on it (deadline, rerun)
+        if not future.set_running_or_notify_cancel():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _fail_worker(self, index, error):
+        with self._lock:
+            self._failures[index] = error
+            orphaned = [request_id for request_id, (_, owner, _) in self._pending.items() if owner == index]
+        for request_id in orphaned:
+            self._finish(request_id, error=error)
+        self._ready.release()
+
+    def _read_results(self):
+        while True:
+            try:
+                message = self._results.get(timeout=HEALTH_INTERVAL)
+            except queue.Empty:
+                for index, process in enumerate(self._processes):
+                    if index not in self._failures and not process.is_alive():
+                        self._fail_worker(index, RuntimeError(f"VQA worker {index} exited ({process.exitcode})"))
+                continue
+
+            if message == _STOP:
+                return
+            kind, index, payload = message
+            if kind == "ready":
+                self._ready.release()
+            elif kind == "failed":
+                self._fail_worker(index, payload)
+            elif kind == "batch":
+                request_ids, answers = payload
+                self.batches_run += 1
+                self.requests_run += len(request_ids)
+                metrics.observe("vqa_batch_size", len(request_ids))
+                for request_id, answer in zip(request_ids, answers):
+                    self._finish(request_id, result=answer)
+            elif kind == "error":
+                request_ids, error = payload
+                metrics.inc("vqa_errors_total", len(request_ids), stage="worker")
+                for request_id in request_ids:
+                    self._finish(request_id, error=error)
+
+    def close(self):
+        for requests in self._requests:
+            requests.put(_STOP)
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        if self._reader is not None:
+            self._results.put(_STOP)
+            self._reader.join()
+        with self._lock:
+            orphaned = list(self._pending)
+        for request_id in orphaned:
+            self._finish(request_id, error=RuntimeError("VQA worker pool closed"))